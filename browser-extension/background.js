@@ -134,11 +134,164 @@ async function logDeceptionEvent(url, scanData, riskLevel) {
 // Scan history storage
 const STORAGE_KEY = 'digital_fortress_scans';
 
+// Offline known-bad filter (Bloom filter served by the backend) and per-host
+// verdict cache. A navigation only hits /url_scan when the filter matches or
+// the host has no cached verdict; otherwise the cached verdict is reused.
+// Each verdict carries its cache_scope: heuristic verdicts are keyed by scheme
+// and host (never for paths with risky keywords, which the backend scores),
+// model verdicts by the full URL, since the model scores all of it.
+const FILTER_STORAGE_KEY = 'digital_fortress_known_bad_filter';
+const VERDICT_STORAGE_KEY = 'digital_fortress_host_verdicts';
+const VERDICT_TTL_MS = 6 * 60 * 60 * 1000; // 6 hours
+const MAX_CACHED_VERDICTS = 2000;
+// Must match risky_keywords in the backend's score_url (app.py)
+const RISKY_PATH_KEYWORDS = [
+  'login', 'verify', 'update', 'password', 'bank', 'gift', 'lottery',
+  'confirm', 'unlock', 'suspend', 'win', 'otp', 'credential',
+];
+
+let knownBadFilter = null; // { generation, version, m, k, bits: Uint8Array }
+
+function base64ToBytes(b64) {
+  const bin = atob(b64);
+  const bytes = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  return bytes;
+}
+
+function bytesToBase64(bytes) {
+  let bin = '';
+  for (let i = 0; i < bytes.length; i++) bin += String.fromCharCode(bytes[i]);
+  return btoa(bin);
+}
+
+// Keys must match HASH_SCHEME in the backend's utils/known_bad_filter.py
+function filterKeys(url) {
+  try {
+    const parsed = new URL(url);
+    let host = parsed.hostname.toLowerCase().replace(/\.$/, '');
+    if (host.startsWith('www.')) host = host.slice(4);
+    if (!host) return [];
+    return [`h:${host}`, `u:${host}${parsed.pathname || '/'}`];
+  } catch (error) {
+    return [];
+  }
+}
+
+// Cache key for a URL's verdict under the scope the backend returned with it
+// ("origin": scheme and host, "url": the full URL), or null when not cacheable
+function verdictKey(url, scope) {
+  try {
+    const parsed = new URL(url);
+    let host = parsed.hostname.toLowerCase().replace(/\.$/, '');
+    if (host.startsWith('www.')) host = host.slice(4);
+    if (!host) return null;
+    if (scope === 'url') return `url:${parsed.protocol}//${host}${parsed.pathname}${parsed.search}`;
+    const path = parsed.pathname.toLowerCase();
+    if (RISKY_PATH_KEYWORDS.some((kw) => path.includes(kw))) return null;
+    return `${parsed.protocol}//${host}`;
+  } catch (error) {
+    return null;
+  }
+}
+
+async function filterContains(key) {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(key));
+  const view = new DataView(digest);
+  const h1 = view.getUint32(0);
+  const h2 = view.getUint32(4);
+  for (let i = 0; i < knownBadFilter.k; i++) {
+    const p = (h1 + i * h2) % knownBadFilter.m;
+    if (!(knownBadFilter.bits[p >> 3] & (1 << (p & 7)))) return false;
+  }
+  return true;
+}
+
+async function loadKnownBadFilter() {
+  if (knownBadFilter) return;
+  const stored = (await chrome.storage.local.get([FILTER_STORAGE_KEY]))[FILTER_STORAGE_KEY];
+  if (stored) {
+    knownBadFilter = { ...stored, bits: base64ToBytes(stored.bits) };
+  }
+}
+
+// Fetch the full filter, or only new bits when we already hold a version
+async function syncKnownBadFilter() {
+  try {
+    await loadKnownBadFilter();
+    const params = knownBadFilter
+      ? `?generation=${encodeURIComponent(knownBadFilter.generation)}&since=${knownBadFilter.version}`
+      : '';
+    const response = await fetch(`${API_BASE_URL}/known_bad_filter${params}`);
+    const result = await response.json();
+    if (!result.success || !result.data) return;
+
+    const data = result.data;
+    if (data.type === 'delta' && knownBadFilter) {
+      for (const p of data.positions) knownBadFilter.bits[p >> 3] |= 1 << (p & 7);
+      knownBadFilter.version = data.version;
+    } else {
+      knownBadFilter = {
+        generation: data.generation,
+        version: data.version,
+        m: data.m,
+        k: data.k,
+        bits: base64ToBytes(data.bits),
+      };
+    }
+    await chrome.storage.local.set({
+      [FILTER_STORAGE_KEY]: { ...knownBadFilter, bits: bytesToBase64(knownBadFilter.bits) },
+    });
+  } catch (error) {
+    // Backend may not serve the filter; scans fall back to calling /url_scan
+    console.warn('Known-bad filter sync failed:', error);
+  }
+}
+
+// Returns a cached verdict when the URL can be decided without the backend
+async function getOfflineVerdict(url) {
+  await loadKnownBadFilter();
+  if (!knownBadFilter) return null;
+
+  const keys = filterKeys(url);
+  if (keys.length === 0) return null;
+  for (const filterKey of keys) {
+    if (await filterContains(filterKey)) return null;
+  }
+
+  const verdicts = (await chrome.storage.local.get([VERDICT_STORAGE_KEY]))[VERDICT_STORAGE_KEY] || {};
+  for (const scope of ['url', 'origin']) {
+    const key = verdictKey(url, scope);
+    const entry = key && verdicts[key];
+    if (entry && Date.now() - entry.ts <= VERDICT_TTL_MS) return { ...entry.data, url: url };
+  }
+  return null;
+}
+
+async function cacheHostVerdict(url, data) {
+  // Verdicts without a scope (older backends, errors) only apply to this exact URL
+  const key = verdictKey(url, data.cache_scope === 'origin' ? 'origin' : 'url');
+  if (!key) return;
+  const result = await chrome.storage.local.get([VERDICT_STORAGE_KEY]);
+  const verdicts = result[VERDICT_STORAGE_KEY] || {};
+  verdicts[key] = { ts: Date.now(), data: data };
+
+  const hosts = Object.keys(verdicts);
+  if (hosts.length > MAX_CACHED_VERDICTS) {
+    hosts
+      .sort((a, b) => verdicts[a].ts - verdicts[b].ts)
+      .slice(0, hosts.length - MAX_CACHED_VERDICTS)
+      .forEach((host) => delete verdicts[host]);
+  }
+  await chrome.storage.local.set({ [VERDICT_STORAGE_KEY]: verdicts });
+}
+
 // Initialize extension
 chrome.runtime.onInstalled.addListener(() => {
   console.log('Digital Fortress Extension Installed');
   chrome.action.setBadgeText({ text: '🛡️' });
   chrome.action.setBadgeBackgroundColor({ color: BADGE_COLORS.safe });
+  syncKnownBadFilter();
 });
 
 // Monitor URL changes and auto-scan
@@ -164,16 +317,26 @@ async function scanUrl(url, tabId) {
     chrome.action.setBadgeText({ text: '...' });
     chrome.action.setBadgeBackgroundColor({ color: BADGE_COLORS.unknown });
 
-    // Call backend API
-    const response = await fetch(`${API_BASE_URL}/url_scan`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ url: url }),
-    });
+    // Reuse the host's cached verdict unless the known-bad filter matches
+    const offline = await getOfflineVerdict(url);
+    let data;
+    if (offline) {
+      data = { success: true, data: offline };
+    } else {
+      // Call backend API
+      const response = await fetch(`${API_BASE_URL}/url_scan`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ url: url }),
+      });
 
-    const data = await response.json();
+      data = await response.json();
+      if (data.success && data.data) {
+        await cacheHostVerdict(url, data.data);
+      }
+    }
 
     if (data.success && data.data) {
       const riskLevel = determineRiskLevel(data.data);
@@ -376,7 +539,13 @@ async function analyzeText(text) {
 
 // Periodic health check (every 5 minutes)
 chrome.alarms.create('healthCheck', { periodInMinutes: 5 });
+// Periodic known-bad filter delta sync (every 15 minutes)
+chrome.alarms.create('knownBadFilterSync', { periodInMinutes: 15 });
 chrome.alarms.onAlarm.addListener((alarm) => {
+  if (alarm.name === 'knownBadFilterSync') {
+    syncKnownBadFilter();
+  }
+
   if (alarm.name === 'healthCheck') {
     // Check if backend is reachable
     fetch(`${API_BASE_URL}/health`)
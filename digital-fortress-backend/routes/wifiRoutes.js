@@ -190,7 +190,7 @@ router.post('/wifi_scan', async (req, res) => {
 });
 
 // @route   GET /api/auto_wifi_scan
-// @desc    Auto Wi‑Fi scan via Flask enrichment (ipapi, dns.google, captive portal, AbuseIPDB, SSL Labs)
+// @desc    Auto Wi‑Fi scan via Flask enrichment (ipapi, system vs DoH DNS, captive portal, AbuseIPDB, TLS handshakes)
 // @access  Public
 router.get('/auto_wifi_scan', async (req, res) => {
   try {
@@ -1,13 +1,24 @@
 import os
 import re
+import json
+import hashlib
 from urllib.parse import urlparse
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
 from uuid import uuid4
 from utils.fraud_enrichment import enrich_fraud_detection, get_fraud_stats
 from dotenv import load_dotenv
-from utils.wifi_auto_scan import auto_wifi_scan
+from utils.wifi_auto_scan import auto_wifi_scan, last_auto_wifi_scan
+from utils.known_bad_filter import KNOWN_BAD, record_known_bad_url
+from utils.url_model import load_model, model_available, score_urls as model_score_urls
+from utils.brand_index import check_lookalike, describe_lookalike, get_brand_index
+from utils.campaign_clusters import assign_cluster, list_clusters
+from utils.tracing import init_tracing, span
+from utils.rate_limit import rate_limited, ENRICHMENT_GATE, WIFI_SCAN_GATE, TRUST_PROXY_HOPS
+from utils.deception_stats import GRANULARITIES, record_event as record_deception_stats, get_stats as get_deception_stats
+from utils.deception_search import MEMORY_SEARCH, index_event as index_deception, search as search_deceptions
 
 load_dotenv()
 
@@ -18,7 +29,9 @@ mongo = None
 try:
     if MONGO_URI:
         from pymongo import MongoClient
-        mongo = MongoClient(MONGO_URI)
+        # connect=False: no monitor threads until first use, so a preforking
+        # server can import the app in its master and fork safely
+        mongo = MongoClient(MONGO_URI, connect=False)
         db = mongo.get_database(os.getenv("MONGO_DB", "digital_fortress"))
     else:
         db = None
@@ -27,15 +40,43 @@ except Exception:
     db = None
 
 app = Flask(__name__)
+if TRUST_PROXY_HOPS:
+    # Take the client address from the entry our own proxies appended to
+    # X-Forwarded-For, not the leftmost one, which the client controls
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUST_PROXY_HOPS)
 CORS(app, resources={r"/api/*": {"origins": os.getenv("CORS_ORIGINS", "*")}})
+init_tracing(app)
 
 SAFE_ADVICE = "URL appears safe, but always verify before entering credentials."
 
+# URL scoring mode: "heuristic" (rule based) or "model" (lexical classifier)
+URL_SCORING_MODES = ("heuristic", "model")
+URL_SCORING_MODE = os.getenv("URL_SCORING_MODE", "heuristic")
+
+# Bump when the heuristic rules in score_url change, so cached GET /api/url_scan verdicts revalidate
+URL_RULES_VERSION = "2"
+# Cache lifetime (seconds) of GET /api/url_scan responses by verdict level
+URL_SCAN_MAX_AGE = {
+    "safe": int(os.getenv("URL_SCAN_MAX_AGE_SAFE", "300")),
+    "medium": int(os.getenv("URL_SCAN_MAX_AGE_MEDIUM", "300")),
+    "danger": int(os.getenv("URL_SCAN_MAX_AGE_DANGER", "3600")),
+}
+
 # In-memory storage for deception events when MongoDB is not configured
 DECEPTIONS = []
 
+# Whether the known-bad filter has been seeded from previously logged deceptions
+_known_bad_seeded = False
+
 # --- Helpers ---
-def score_url(url: str):
+def score_url(url: str, mode: str = None):
+    mode = mode or URL_SCORING_MODE
+    if mode == "model" and model_available():
+        try:
+            return score_url_model([url])[0]
+        except Exception:
+            pass  # fall back to heuristics
+
     try:
         parsed = urlparse(url)
         host = parsed.hostname or ""
@@ -69,24 +110,59 @@ def score_url(url: str):
             risk += 10
             reasons.append("Numeric-looking domain")
 
-        # Cap 0..100
-        risk = max(0, min(100, risk))
-
-        safe = risk < 30
-        level = "safe" if safe else ("danger" if risk >= 70 else "medium")
-        reason = SAFE_ADVICE if safe else (reasons[0] if reasons else "Potential risk detected")
-
-        return {
-            "url": url,
-            "risk_score": risk,
-            "safe": safe,
-            "level": level,
-            "reason": reason,
-            "reasons": reasons,
-            "advice": SAFE_ADVICE if safe else "Proceed with caution. Verify the site before entering any information.",
-        }
+        # Lookalike of a protected brand (typosquat / homoglyph)
+        lookalike = check_lookalike(host)
+        if lookalike:
+            risk += lookalike["score"]
+            reasons.insert(0, describe_lookalike(lookalike))
+
+        return build_url_verdict(url, risk, reasons)
     except Exception as e:
-        return {"url": url, "risk_score": 50, "safe": False, "level": "medium", "reason": str(e)}
+        return {"url": url, "risk_score": 50, "safe": False, "level": "medium", "reason": str(e), "cache_scope": "url"}
+
+
+def build_url_verdict(url: str, risk: int, reasons: list, cache_scope: str = "origin"):
+    """Verdict for a URL. cache_scope tells clients what the verdict may be reused for:
+    "origin" (same scheme and host, when the path has no risky keywords) or "url" (this URL only)."""
+    # Cap 0..100
+    risk = max(0, min(100, risk))
+
+    safe = risk < 30
+    level = "safe" if safe else ("danger" if risk >= 70 else "medium")
+    reason = SAFE_ADVICE if safe else (reasons[0] if reasons else "Potential risk detected")
+
+    return {
+        "url": url,
+        "risk_score": risk,
+        "safe": safe,
+        "level": level,
+        "reason": reason,
+        "reasons": reasons,
+        "advice": SAFE_ADVICE if safe else "Proceed with caution. Verify the site before entering any information.",
+        "cache_scope": cache_scope,
+    }
+
+
+def score_url_model(urls: list):
+    """Score a batch of URLs with the lexical classifier (vectorized)."""
+    results = []
+    for url, r in zip(urls, model_score_urls(urls)):
+        risk, reasons = r["risk_score"], r["reasons"]
+        lookalike = check_lookalike(urlparse(url).hostname or "")
+        if lookalike:
+            risk += lookalike["score"]
+            reasons = [describe_lookalike(lookalike)] + reasons
+        # The model scores the whole URL, so its verdict only holds for this URL
+        results.append({**build_url_verdict(url, risk, reasons, cache_scope="url"), "mode": "model", "model_version": r["model_version"]})
+    return results
+
+
+def url_scan_version(mode: str = None) -> str:
+    """Version of everything a URL verdict depends on: rules, scoring mode, model and brand list."""
+    mode = mode or URL_SCORING_MODE
+    model = load_model() if mode == "model" else None
+    parts = [URL_RULES_VERSION, mode, (model or {}).get("version", "none"), get_brand_index().fingerprint]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:12]
 
 
 def analyze_text_basic(text: str):
@@ -128,17 +204,52 @@ def health():
 
 
 @app.route("/api/url_scan", methods=["POST"])
+@rate_limited("url_scan")
 def url_scan():
     data = request.get_json(silent=True) or {}
     url = data.get("url", "")
     if not url:
         return jsonify({"success": False, "error": "url is required"}), 400
+    mode = data.get("mode")
+    if mode is not None and mode not in URL_SCORING_MODES:
+        return jsonify({"success": False, "error": f"mode must be one of {', '.join(URL_SCORING_MODES)}"}), 400
 
-    result = score_url(url)
+    with span("score_url"):
+        result = score_url(url, mode)
     return jsonify({"success": True, "data": result})
 
 
+@app.route("/api/url_scan", methods=["GET"])
+@rate_limited("url_scan")
+def url_scan_cacheable():
+    """GET form of url_scan with HTTP caching headers, for browsers and reverse proxies."""
+    url = request.args.get("url", "")
+    if not url:
+        return jsonify({"success": False, "error": "url is required"}), 400
+    mode = request.args.get("mode")
+    if mode is not None and mode not in URL_SCORING_MODES:
+        return jsonify({"success": False, "error": f"mode must be one of {', '.join(URL_SCORING_MODES)}"}), 400
+
+    with span("score_url"):
+        result = score_url(url, mode)
+    version = url_scan_version(mode)
+    digest = hashlib.sha256(json.dumps(result, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    response = jsonify({"success": True, "data": result})
+    response.vary.update(["Accept-Encoding", "X-Debug-Timing"])
+    response.headers["X-Rules-Version"] = version
+    if request.headers.get("X-Debug-Timing") == "1":
+        # The timing body differs per request, so it must not share the verdict's validator
+        response.cache_control.no_store = True
+        return response
+    response.set_etag(f"{version}-{digest}")
+    response.cache_control.public = True
+    response.cache_control.max_age = URL_SCAN_MAX_AGE.get(result.get("level"), 300)
+    return response.make_conditional(request)
+
+
 @app.route("/api/detect_fraud", methods=["POST"])
+@rate_limited("detect_fraud")
 def detect_fraud():
     data = request.get_json(silent=True) or {}
     text = data.get("text", "")
@@ -146,7 +257,8 @@ def detect_fraud():
         return jsonify({"success": False, "error": "text is required"}), 400
 
     # Get basic text analysis
-    basic_result = analyze_text_basic(text)
+    with span("analyze_text_basic"):
+        basic_result = analyze_text_basic(text)
     
     # Enrich with external API checks
     try:
@@ -157,8 +269,14 @@ def detect_fraud():
             "VIRUSTOTAL_KEY": os.getenv("VIRUSTOTAL_KEY")
         }
         
-        # Run the enrichment function (synchronous version)
-        enrichment_result = enrich_fraud_detection(text)
+        # Run the enrichment function (synchronous version); when too many
+        # enrichments are in flight, shed load to cached/local-only checks
+        shed = not ENRICHMENT_GATE.try_acquire()
+        try:
+            enrichment_result = enrich_fraud_detection(text, local_only=shed)
+        finally:
+            if not shed:
+                ENRICHMENT_GATE.release()
         
         # Calculate combined fraud score
         local_heuristic_score = basic_result.get("confidence", 0)
@@ -192,6 +310,7 @@ def detect_fraud():
             "external_sources": enrichment_result.get("external_sources", {}),
             "advice": basic_result.get("advice", "Proceed with caution."),
             "cached": enrichment_result.get("cached", False),
+            "degraded": enrichment_result.get("degraded", False),
             "privacy_notice": "External APIs used only for URL reputation checks."
         }
         
@@ -219,24 +338,37 @@ def detect_fraud():
         })
 
 
-@app.route("/api/auto_wifi_scan", methods=["GET"])
-def auto_wifi_scan_route():
-    """Automatically scan current network using public resolvers/APIs.
-    Privacy-safe: only public IP/network metadata is queried.
-    """
+def _auto_wifi_scan_response():
+    # Too many scans in flight: serve the last result instead of queueing
+    if not WIFI_SCAN_GATE.try_acquire():
+        last = last_auto_wifi_scan()
+        if last is None:
+            resp = jsonify({"success": False, "error": "Scanner busy, retry shortly"})
+            resp.status_code = 503
+            resp.headers["Retry-After"] = "2"
+            return resp
+        return jsonify({"success": True, "data": {**last, "cached": True, "degraded": True}})
     try:
         result = auto_wifi_scan()
         return jsonify({"success": True, "data": result})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        WIFI_SCAN_GATE.release()
+
+
+@app.route("/api/auto_wifi_scan", methods=["GET"])
+@rate_limited("auto_wifi_scan")
+def auto_wifi_scan_route():
+    """Automatically scan current network using public resolvers/APIs.
+    Privacy-safe: only public IP/network metadata is queried.
+    """
+    return _auto_wifi_scan_response()
 
 @app.route("/auto_wifi_scan", methods=["GET"])
+@rate_limited("auto_wifi_scan")
 def auto_wifi_scan_route_alias():
-    try:
-        result = auto_wifi_scan()
-        return jsonify({"success": True, "data": result})
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+    return _auto_wifi_scan_response()
 
 @app.route("/api/detect_fraud_async", methods=["POST"])
 def detect_fraud_async():
@@ -258,6 +390,7 @@ def detect_fraud_async():
 def fraud_stats():
     """Get statistics about fraud detection."""
     stats = get_fraud_stats()
+    stats["load_shedding"] = {"enrichment": ENRICHMENT_GATE.stats(), "auto_wifi_scan": WIFI_SCAN_GATE.stats()}
     return jsonify({"success": True, "data": stats})
 
 
@@ -286,6 +419,7 @@ def chatbot():
 
 
 @app.route("/api/deceptions/log", methods=["POST"])  # Optional logging
+@rate_limited("deceptions_log")
 def deceptions_log():
     payload = request.get_json(silent=True) or {}
     now_iso = datetime.utcnow().isoformat()
@@ -307,20 +441,87 @@ def deceptions_log():
         "metadata": {"source": payload.get("source", "Browser Extension"), "sanitized": True},
     }
 
+    record_threat_source(event["threat_source"])
+    event["cluster_id"] = assign_cluster(event, db)
+
     if db is not None:
         try:
-            db.deceptions.insert_one({**event, "_source": "extension", "created_at": now_iso})
+            db.deceptions.insert_one({
+                **event, "_source": "extension", "created_at": now_iso,
+                "search_terms": index_deception(event, db),
+            })
+            record_deception_stats(event, db)
             return jsonify({"success": True, "data": {"id": event["_id"], "status": event["status"]}})
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
     # Store in memory and cap list length
     DECEPTIONS.insert(0, event)
+    index_deception(event)
     if len(DECEPTIONS) > 200:
-        DECEPTIONS.pop()
+        MEMORY_SEARCH.remove(DECEPTIONS.pop())
+    record_deception_stats(event)
     return jsonify({"success": True, "data": {"id": event["_id"], "status": event["status"]}})
 
 
+def record_threat_source(source):
+    """Add a reported threat source to the known-bad filter if our own scoring rates it as danger.
+    The reporter's severity is not trusted: anyone can post events to /api/deceptions/log."""
+    if not isinstance(source, str) or not source:
+        return
+    url = source if "://" in source else f"https://{source}"
+    if score_url(url)["level"] == "danger":
+        record_known_bad_url(source)
+
+
+def seed_known_bad_filter():
+    """Add threat sources of previously logged events to the known-bad filter (once per process)."""
+    global _known_bad_seeded
+    if _known_bad_seeded:
+        return
+    _known_bad_seeded = True
+    sources = []
+    if db is not None:
+        try:
+            sources = db.deceptions.distinct("threat_source")
+        except Exception:
+            sources = []
+    sources += [d.get("threat_source") for d in DECEPTIONS]
+    for src in sources:
+        record_threat_source(src)
+
+
+@app.route("/api/known_bad_filter", methods=["GET"])
+def known_bad_filter():
+    """Bloom filter of known-bad hosts/URLs for offline checks in the extension.
+    Pass ?generation=&since= from a previous response to receive only new bits.
+    """
+    seed_known_bad_filter()
+
+    since = request.args.get("since")
+    data = KNOWN_BAD.export(
+        generation=request.args.get("generation"),
+        since=int(since) if since and since.isdigit() else None,
+    )
+    return jsonify({"success": True, "data": data})
+
+
+def _public_event(d):
+    """Sanitized feed representation of a stored deception event."""
+    return {
+        "id": str(d.get("_id")),
+        "title": d.get("title"),
+        "summary": d.get("summary"),
+        "type": d.get("type"),
+        "threat_source": d.get("threat_source"),
+        "protected_items": d.get("protected_items", []),
+        "severity": d.get("severity", "Medium"),
+        "timestamp": d.get("timestamp", datetime.utcnow().isoformat()),
+        "timeline": {"detection": (d.get("timeline") or {}).get("detection")},
+        "cluster_id": d.get("cluster_id"),
+    }
+
+
 @app.route("/api/deceptions/public", methods=["GET"])  # Public feed (sanitized)
 def deceptions_public():
     limit = int(request.args.get("limit", 20))
@@ -332,38 +533,51 @@ def deceptions_public():
             cursor = (
                 db.deceptions.find({"status": "published"}).sort("timestamp", -1).skip(skip).limit(limit)
             )
-            for d in cursor:
-                items.append({
-                    "id": str(d.get("_id")),
-                    "title": d.get("title"),
-                    "summary": d.get("summary"),
-                    "type": d.get("type"),
-                    "threat_source": d.get("threat_source"),
-                    "protected_items": d.get("protected_items", []),
-                    "severity": d.get("severity", "Medium"),
-                    "timestamp": d.get("timestamp", datetime.utcnow().isoformat()),
-                    "timeline": {"detection": (d.get("timeline") or {}).get("detection")},
-                })
+            items = [_public_event(d) for d in cursor]
         except Exception:
             items = []
     else:
         # Use in-memory store
-        for d in DECEPTIONS[skip: skip + limit]:
-            items.append({
-                "id": d["_id"],
-                "title": d["title"],
-                "summary": d["summary"],
-                "type": d["type"],
-                "threat_source": d.get("threat_source"),
-                "protected_items": d.get("protected_items", []),
-                "severity": d.get("severity", "Medium"),
-                "timestamp": d.get("timestamp"),
-                "timeline": {"detection": (d.get("timeline") or {}).get("detection")},
-            })
+        items = [_public_event(d) for d in DECEPTIONS[skip: skip + limit]]
 
     return jsonify({"success": True, "count": len(items), "data": items})
 
 
+@app.route("/api/deceptions/search", methods=["GET"])  # Keyword/domain search (prefix matching)
+def deceptions_search():
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"success": False, "error": "q is required"}), 400
+    limit = max(1, min(int(request.args.get("limit", 20)), 100))
+    skip = max(0, int(request.args.get("skip", 0)))
+    try:
+        docs, has_more = search_deceptions(q, db, skip=skip, limit=limit)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    items = [_public_event(d) for d in docs]
+    return jsonify({"success": True, "count": len(items), "has_more": has_more, "data": items})
+
+
+@app.route("/api/deceptions/campaigns", methods=["GET"])  # Public feed grouped by campaign
+def deceptions_campaigns():
+    limit = int(request.args.get("limit", 20))
+    skip = int(request.args.get("skip", 0))
+    try:
+        items = list_clusters(db, skip=skip, limit=limit)
+    except Exception:
+        items = []
+    return jsonify({"success": True, "count": len(items), "data": items})
+
+
+@app.route("/api/deceptions/stats", methods=["GET"])  # Rolling counters by type/severity/source
+def deceptions_stats():
+    granularity = request.args.get("granularity", "hour")
+    if granularity not in GRANULARITIES:
+        return jsonify({"success": False, "error": f"granularity must be one of {', '.join(GRANULARITIES)}"}), 400
+    window = int(request.args.get("window", 24))
+    return jsonify({"success": True, "data": get_deception_stats(granularity, window, db)})
+
+
 @app.route("/api/deceptions/<id>", methods=["GET"])  # Public details
 def deceptions_get(id):
     if db is not None:
@@ -383,6 +597,7 @@ def deceptions_get(id):
                 "timestamp": d.get("timestamp", datetime.utcnow().isoformat()),
                 "timeline": d.get("timeline"),
                 "metadata": d.get("metadata", {}),
+                "cluster_id": d.get("cluster_id"),
             }
             return jsonify({"success": True, "data": d_out})
         except Exception:
@@ -401,6 +616,7 @@ def deceptions_get(id):
                 "timestamp": d.get("timestamp"),
                 "timeline": d.get("timeline"),
                 "metadata": d.get("metadata", {}),
+                "cluster_id": d.get("cluster_id"),
             }
             return jsonify({"success": True, "data": d_out})
     return jsonify({"success": False, "message": "Not found"}), 404
@@ -0,0 +1,193 @@
+"""
+Bulk offline scoring
+--------------------
+Re-score large URL / message datasets without going through the HTTP API:
+- Streams JSONL or CSV input records (a `url` and/or `text` field each)
+- Scores URLs with score_url, messages with analyze_text_basic and, with
+  --enrich, enrich_fraud_detection
+- Runs chunks on a process pool with a bounded number of chunks in flight,
+  so memory stays flat regardless of input size
+- Writes JSONL output in input order and records a checkpoint after each
+  flushed chunk; --resume continues from the last checkpoint
+
+Usage:
+    python bulk_score.py urls.jsonl -o scored.jsonl --workers 8
+    python bulk_score.py messages.csv -o scored.jsonl --enrich --resume
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from itertools import islice
+from multiprocessing import get_context, get_all_start_methods
+from typing import Dict, List, Any, Iterator, Optional
+
+from app import score_url, score_url_model, analyze_text_basic, model_available, URL_SCORING_MODE, URL_SCORING_MODES
+from utils.fraud_enrichment import enrich_fraud_detection
+from utils.brand_index import get_brand_index
+from utils.url_model import load_model
+
+
+def read_records(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream records from a JSONL or CSV file."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    record = {"_error": f"invalid JSON: {str(e)}"}
+                yield record if isinstance(record, dict) else {"url": str(record)}
+
+
+def score_chunk(records: List[Dict[str, Any]], options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Score one chunk of records (runs in a worker process)."""
+    url_field, text_field, id_field = options["url_field"], options["text_field"], options["id_field"]
+
+    urls = [r.get(url_field) or "" for r in records]
+    url_results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    to_score = [i for i, u in enumerate(urls) if u]
+    if options["mode"] == "model" and model_available() and to_score:
+        # One vectorized call for the whole chunk
+        for i, result in zip(to_score, score_url_model([urls[i] for i in to_score])):
+            url_results[i] = result
+    else:
+        for i in to_score:
+            url_results[i] = score_url(urls[i], options["mode"])
+
+    out = []
+    for record, url, url_result in zip(records, urls, url_results):
+        item: Dict[str, Any] = {"id": record.get(id_field)}
+        if record.get("_error"):
+            item["error"] = record["_error"]
+        if url:
+            item["url"] = url
+            item["url_result"] = url_result
+        text = record.get(text_field)
+        if text:
+            item["text_result"] = analyze_text_basic(text)
+            if options["enrich"]:
+                try:
+                    item["enrichment"] = enrich_fraud_detection(text)
+                except Exception as e:
+                    item["enrichment"] = {"error": str(e)}
+        out.append(item)
+    return out
+
+
+def chunked(records: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return {"records_done": int(state["records_done"]), "output_bytes": int(state["output_bytes"])}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {"records_done": 0, "output_bytes": 0}
+
+
+def write_checkpoint(path: str, records_done: int, output_bytes: int) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"records_done": records_done, "output_bytes": output_bytes, "updated_at": time.time()}, f)
+    os.replace(tmp, path)
+
+
+def run(args: argparse.Namespace) -> int:
+    checkpoint = args.checkpoint or f"{args.output}.checkpoint"
+    state = read_checkpoint(checkpoint) if args.resume else {"records_done": 0, "output_bytes": 0}
+    done = state["records_done"]
+
+    out = open(args.output, "ab" if done else "wb")
+    if done:
+        # Drop anything written after the last checkpoint (interrupted chunk)
+        out.truncate(state["output_bytes"])
+        out.seek(0, os.SEEK_END)
+
+    records = islice(read_records(args.input, args.format), done, None)
+    options = {
+        "url_field": args.url_field,
+        "text_field": args.text_field,
+        "id_field": args.id_field,
+        "mode": args.mode or URL_SCORING_MODE,
+        "enrich": args.enrich,
+    }
+
+    started = time.time()
+    processed = 0
+    max_in_flight = args.workers * 2
+    pending: deque = deque()
+
+    def flush_one() -> None:
+        nonlocal done, processed
+        results = pending.popleft().get()
+        out.write(b"".join(json.dumps(r, default=str).encode("utf-8") + b"\n" for r in results))
+        out.flush()
+        os.fsync(out.fileno())
+        done += len(results)
+        processed += len(results)
+        write_checkpoint(checkpoint, done, out.tell())
+        if args.progress:
+            rate = processed / max(time.time() - started, 1e-9)
+            print(f"\r{done} records scored ({rate:.0f}/s)", end="", file=sys.stderr, flush=True)
+
+    # Build indexes once in the parent so forked workers share them
+    get_brand_index()
+    load_model()
+
+    ctx = get_context("fork") if "fork" in get_all_start_methods() else get_context()
+    with ctx.Pool(processes=args.workers) as pool:
+        for chunk in chunked(records, args.chunk_size):
+            pending.append(pool.apply_async(score_chunk, (chunk, options)))
+            if len(pending) >= max_in_flight:
+                flush_one()
+        while pending:
+            flush_one()
+
+    out.close()
+    if args.progress:
+        print(file=sys.stderr)
+    print(json.dumps({"records_scored": processed, "records_total": done, "seconds": round(time.time() - started, 2)}))
+    return 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Score URL / message datasets offline.")
+    parser.add_argument("input", help="JSONL or CSV file with url and/or text fields")
+    parser.add_argument("-o", "--output", required=True, help="JSONL output file")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="input format (default: from extension)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="records per chunk")
+    parser.add_argument("--url-field", default="url")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--mode", choices=URL_SCORING_MODES, default=None, help="URL scoring mode")
+    parser.add_argument("--enrich", action="store_true", help="also run enrich_fraud_detection on text")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    parser.add_argument("--progress", action="store_true", help="print progress to stderr")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    args.chunk_size = max(1, args.chunk_size)
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
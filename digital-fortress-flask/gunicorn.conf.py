@@ -0,0 +1,97 @@
+"""
+Gunicorn configuration for the Flask API:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+- The app and its read-only state are preloaded in the master (wsgi.py),
+  so workers share them copy-on-write
+- Workers default to the number of usable CPUs, each with a few threads
+  for requests waiting on upstream APIs
+- Workers are recycled after a number of requests, or once their memory
+  grows past GUNICORN_MAX_WORKER_MEMORY_MB over their post-fork baseline
+- When a feed file (protected brands, URL model) changes, or on
+  `kill -HUP <master pid>`, the master rebuilds that state and replaces
+  the workers gracefully
+"""
+
+import os
+import time
+import signal
+import threading
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5001')}")
+preload_app = True
+workers = int(os.getenv("GUNICORN_WORKERS", str(max(2, _CPUS))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None  # empty disables
+errorlog = "-"
+
+MAX_WORKER_MEMORY_MB = float(os.getenv("GUNICORN_MAX_WORKER_MEMORY_MB", "300"))
+FEED_POLL_SECONDS = float(os.getenv("GUNICORN_FEED_POLL_SECONDS", "30"))
+FEED_FILES = [
+    f for f in (
+        os.getenv("PROTECTED_BRANDS_FILE"),
+        os.getenv("URL_MODEL_PATH", os.path.join(_HERE, "models", "url_lexical_model.json")),
+    ) if f
+]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _feed_mtimes():
+    mtimes = {}
+    for path in FEED_FILES:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def _watch_feeds(server):
+    seen = _feed_mtimes()
+    while True:
+        time.sleep(FEED_POLL_SECONDS)
+        current = _feed_mtimes()
+        if current != seen:
+            seen = current
+            server.log.info("Feed files changed; reloading workers")
+            os.kill(os.getpid(), signal.SIGHUP)
+
+
+def when_ready(server):
+    if FEED_FILES and FEED_POLL_SECONDS > 0:
+        threading.Thread(target=_watch_feeds, args=(server,), name="feed-watcher", daemon=True).start()
+
+
+def on_reload(server):
+    # Runs in the master on SIGHUP, before the replacement workers are forked
+    from wsgi import refresh
+    refresh()
+
+
+def post_fork(server, worker):
+    worker.baseline_rss_mb = _rss_mb()
+
+
+def post_request(worker, req, environ, resp):
+    growth = _rss_mb() - getattr(worker, "baseline_rss_mb", 0)
+    if MAX_WORKER_MEMORY_MB and growth > MAX_WORKER_MEMORY_MB and worker.alive:
+        worker.log.warning(f"Worker {worker.pid} grew {growth:.0f}MB since fork; recycling")
+        worker.alive = False
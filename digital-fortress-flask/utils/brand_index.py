@@ -0,0 +1,377 @@
+"""
+Protected Brand Index
+---------------------
+This module detects lookalike domains of protected brands (banks, payment
+apps, large platforms) without scanning the brand list linearly:
+- Confusable-character skeletons (IDN homoglyphs, digit swaps, "rn" -> "m")
+- Exact skeleton lookup for homoglyphs and brand names in subdomains
+- A symmetric-deletion index for bounded edit-distance (typosquat) search:
+  every brand skeleton is stored under its deletion variants, so a lookup
+  only generates the query's own variants and verifies a handful of
+  candidates, independent of how many brands are indexed
+
+Brands come from DEFAULT_PROTECTED_DOMAINS plus an optional file named by
+PROTECTED_BRANDS_FILE (one domain per line, '#' comments allowed). Domains the
+brands themselves operate under other names (BRAND_OWNED_DOMAINS, e.g.
+live.com for Outlook) are never flagged.
+
+A typosquat's score shrinks with the edit distance relative to the brand's
+length, so an edit alone never reaches "danger" without a second signal.
+Brand names of five or six characters tolerate one edit only when it looks
+like a typing slip (a doubled or dropped double letter, a neighbouring key)
+or the host has another signal (a risky TLD, a login-style keyword), since
+arbitrary single edits turn "gmail" into "email" and "apple" into "apply".
+Ordinary words in COMMON_WORDS never count as typosquats, and a brand's own
+name under a country-code TLD (google.co.in, amazon.de) is not flagged.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Any, Optional, Set, Iterable
+
+from utils.url_model import RISKY_TLDS
+
+logger = logging.getLogger("brand_index")
+
+PROTECTED_BRANDS_FILE = os.getenv("PROTECTED_BRANDS_FILE")
+BRAND_MAX_DISTANCE = int(os.getenv("BRAND_MAX_DISTANCE", "1"))
+
+DEFAULT_PROTECTED_DOMAINS = [
+    "paypal.com", "google.com", "gmail.com", "apple.com", "icloud.com", "microsoft.com", "outlook.com",
+    "office.com", "amazon.com", "amazon.in", "facebook.com", "instagram.com", "whatsapp.com",
+    "netflix.com", "linkedin.com", "twitter.com", "dropbox.com", "yahoo.com", "github.com",
+    "chase.com", "bankofamerica.com", "wellsfargo.com", "citibank.com", "hsbc.com", "barclays.co.uk",
+    "hdfcbank.com", "icicibank.com", "onlinesbi.sbi", "sbi.co.in", "axisbank.com", "kotak.com",
+    "paytm.com", "phonepe.com", "razorpay.com", "flipkart.com", "binance.com", "coinbase.com",
+]
+
+# Domains operated by the protected brands under other names; treated as protected, not as lookalikes
+BRAND_OWNED_DOMAINS = [
+    "live.com", "hotmail.com", "msn.com", "microsoftonline.com", "office365.com", "googlemail.com",
+    "youtube.com", "me.com", "mac.com", "paypal.me", "fb.com", "messenger.com", "amazon.co.uk",
+    "amazonaws.com", "linkedin.cn", "x.com", "githubusercontent.com",
+]
+
+# Ordinary words within one edit of a brand name; never reported as typosquats
+COMMON_WORDS = {
+    "email", "apply", "ample", "cloud", "phase", "chaser", "chasm", "finance", "phoneme", "googly",
+    "amazing", "office", "offices", "kodak", "yahoos", "catch",
+}
+
+# Host keywords that count as a second signal for short-brand typosquats
+SIGNAL_KEYWORDS = ("login", "signin", "secure", "verify", "account", "update", "support", "wallet", "auth")
+
+# Brand names shorter than this only tolerate typing-slip edits (or need a second signal)
+SHORT_BRAND_LEN = 7
+
+# Score added by each lookalike technique
+LOOKALIKE_SCORES = {
+    "homoglyph": 70,
+    "typosquat": 70,
+    "suffix_swap": 20,
+    "combosquat": 50,
+    "brand_in_subdomain": 50,
+}
+
+# Hosting platforms that give every customer a subdomain: the customer's label is the registrable one
+_HOSTING_SUFFIXES = {
+    "github.io", "gitlab.io", "blogspot.com", "herokuapp.com", "netlify.app", "vercel.app", "pages.dev",
+    "web.app", "firebaseapp.com", "appspot.com", "azurewebsites.net", "wixsite.com", "weebly.com",
+}
+# Multi-label public suffixes; anything else is treated as a single-label TLD
+_MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "co.in", "org.in", "net.in",
+    "gov.in", "ac.in", "co.jp", "com.br", "com.cn", "co.nz", "co.za", "com.sg", "com.mx",
+} | _HOSTING_SUFFIXES
+
+# QWERTY key positions (row, staggered column) for neighbouring-key typos
+_KEY_POS = {
+    ch: (row, col + offset)
+    for row, (keys, offset) in enumerate([("qwertyuiop", 0.0), ("asdfghjkl", 0.25), ("zxcvbnm", 0.75)])
+    for col, ch in enumerate(keys)
+}
+
+# Single characters that render like ASCII letters (Cyrillic, Greek, digits, ...)
+_CONFUSABLES = {
+    "а": "a", "е": "e", "о": "o", "р": "p", "с": "c", "у": "y", "х": "x", "і": "l", "ј": "j",
+    "ѕ": "s", "һ": "h", "ԁ": "d", "ɡ": "g", "ӏ": "l", "к": "k", "м": "m", "т": "t", "в": "b",
+    "н": "h", "ο": "o", "α": "a", "ε": "e", "ι": "l", "κ": "k", "ν": "v", "ρ": "p", "τ": "t",
+    "υ": "u", "χ": "x", "ı": "l", "ℓ": "l",
+    "0": "o", "1": "l", "i": "l", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "9": "g",
+}
+# Multi-character sequences that read like a single letter
+_SEQUENCES = [("rn", "m"), ("vv", "w"), ("cl", "d")]
+
+
+def skeleton(label: str) -> str:
+    """Confusable-insensitive form of a domain label."""
+    try:
+        if label.startswith("xn--"):
+            label = label.encode("ascii").decode("idna")
+    except Exception:
+        pass
+    label = unicodedata.normalize("NFKC", label).lower()
+    label = "".join(_CONFUSABLES.get(ch, ch) for ch in label)
+    label = unicodedata.normalize("NFKD", label)
+    label = "".join(ch for ch in label if not unicodedata.combining(ch) and ch != "-")
+    for seq, repl in _SEQUENCES:
+        label = label.replace(seq, repl)
+    return label
+
+
+def split_domain(host: str) -> List[str]:
+    """Return [subdomain labels..., registrable label, suffix]."""
+    labels = (host or "").lower().rstrip(".").split(".")
+    if len(labels) >= 3 and ".".join(labels[-2:]) in _MULTI_LABEL_SUFFIXES:
+        return labels[:-2] + [".".join(labels[-2:])]
+    return labels
+
+
+def allowed_distance(length: int, max_distance: int = BRAND_MAX_DISTANCE) -> int:
+    """Edit distance tolerated for a brand name of this length (very short names only match exactly)."""
+    if length < 5:
+        return 0
+    if length < 12:
+        return min(1, max_distance)
+    return max_distance
+
+
+def _adjacent_keys(a: str, b: str) -> bool:
+    if a not in _KEY_POS or b not in _KEY_POS:
+        return False
+    (ra, ca), (rb, cb) = _KEY_POS[a], _KEY_POS[b]
+    return (ra == rb and abs(ca - cb) == 1) or (abs(ra - rb) == 1 and abs(ca - cb) < 1)
+
+
+def is_typing_slip(label: str, brand: str) -> bool:
+    """Whether a label one edit away from brand looks like a typing slip of it:
+    a doubled letter (paypall), a dropped double letter (gogle) or a neighbouring key (amazom)."""
+    i = 0
+    while i < min(len(label), len(brand)) and label[i] == brand[i]:
+        i += 1
+    if len(label) == len(brand) + 1:
+        return label[i + 1:] == brand[i:] and label[i] in (label[i - 1:i] + label[i + 1:i + 2])
+    if len(label) == len(brand) - 1:
+        return label[i:] == brand[i + 1:] and brand[i] in (brand[i - 1:i] + brand[i + 1:i + 2])
+    if len(label) == len(brand) and i < len(label):
+        return label[i + 1:] == brand[i + 1:] and _adjacent_keys(label[i], brand[i])
+    return False
+
+
+def typosquat_score(distance: int, length: int) -> int:
+    """Typosquat score scaled by how much of the brand name was edited."""
+    return int(LOOKALIKE_SCORES["typosquat"] * max(0.0, 1 - distance / max(length, 1)))
+
+
+def levenshtein(a: str, b: str, bound: int) -> int:
+    """Edit distance, or bound + 1 as soon as it must exceed bound."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > bound:
+            return bound + 1
+        prev = cur
+    return prev[-1]
+
+
+def _deletions(word: str, depth: int) -> Set[str]:
+    """All strings reachable from word by deleting up to depth characters."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+class BrandIndex:
+    """Index of protected brand domains for homoglyph and typosquat lookups."""
+
+    def __init__(self, domains: Iterable[str] = (), max_distance: int = BRAND_MAX_DISTANCE,
+                 owned: Iterable[str] = BRAND_OWNED_DOMAINS):
+        self.max_distance = max_distance
+        self.domains: Set[str] = set()
+        self.owned: Set[str] = {d.strip().lower().rstrip(".") for d in owned if d.strip()}
+        self._by_skeleton: Dict[str, List[str]] = {}  # skeleton -> brand domains
+        self._deletes: Dict[str, Set[str]] = {}  # deletion variant -> skeletons
+        self._max_len = 0
+        self._fingerprint: Optional[str] = None
+        for domain in domains:
+            self.add(domain)
+
+    def __len__(self) -> int:
+        return len(self.domains)
+
+    @property
+    def fingerprint(self) -> str:
+        """Short hash of the brand list; changes whenever a domain is added."""
+        if self._fingerprint is None:
+            listed = sorted(self.domains) + ["owned:" + d for d in sorted(self.owned)]
+            self._fingerprint = hashlib.sha256("\n".join(listed).encode("utf-8")).hexdigest()[:16]
+        return self._fingerprint
+
+    def add(self, domain: str) -> None:
+        domain = domain.strip().lower().rstrip(".")
+        if not domain or domain in self.domains:
+            return
+        labels = split_domain(domain)
+        if len(labels) < 2:
+            return
+        self.domains.add(domain)
+        self._fingerprint = None
+        skel = skeleton(labels[-2])
+        self._by_skeleton.setdefault(skel, []).append(domain)
+        self._max_len = max(self._max_len, len(skel))
+        for variant in _deletions(skel, allowed_distance(len(skel), self.max_distance)):
+            self._deletes.setdefault(variant, set()).add(skel)
+
+    def is_protected(self, host: str) -> bool:
+        """True if host is a protected or brand-owned domain, or one of their subdomains."""
+        labels = (host or "").lower().rstrip(".").split(".")
+        for i in range(len(labels) - 1):
+            suffix = ".".join(labels[i:])
+            if suffix in self.domains or suffix in self.owned:
+                return True
+        return False
+
+    def search(self, label: str) -> Optional[Dict[str, Any]]:
+        """Closest brand for a registrable label within the allowed edit distance."""
+        skel = skeleton(label)
+        if skel in self._by_skeleton:
+            return {"brand": self._by_skeleton[skel][0], "distance": 0}
+        if len(skel) < 4 or len(skel) > self._max_len + self.max_distance:
+            return None
+        # A brand can be at most max_distance longer, which bounds its tolerated distance
+        depth = allowed_distance(min(len(skel) + self.max_distance, self._max_len), self.max_distance)
+        best = None
+        for variant in _deletions(skel, depth):
+            for candidate in self._deletes.get(variant, ()):
+                bound = allowed_distance(len(candidate), self.max_distance)
+                dist = levenshtein(skel, candidate, bound)
+                if dist <= bound and (best is None or dist < best["distance"]):
+                    best = {"brand": self._by_skeleton[candidate][0], "distance": dist}
+        return best
+
+    def _plausible_typosquat(self, registrable: str, match: Dict[str, Any], host: str, labels: List[str]) -> bool:
+        """Filter edit-distance matches that are ordinary words or arbitrary edits of short brand names."""
+        if registrable in COMMON_WORDS:
+            return False
+        brand = skeleton(split_domain(match["brand"])[-2])
+        if len(brand) >= SHORT_BRAND_LEN:
+            return True
+        if is_typing_slip(skeleton(registrable), brand):
+            return True
+        return labels[-1].split(".")[-1] in RISKY_TLDS or any(kw in host for kw in SIGNAL_KEYWORDS)
+
+    def check_host(self, host: str) -> Optional[Dict[str, Any]]:
+        """Classify host as a lookalike of a protected brand, or None."""
+        host = (host or "").lower().rstrip(".")
+        if not host or self.is_protected(host):
+            return None
+        labels = split_domain(host)
+        if len(labels) < 2:
+            return None
+        registrable = labels[-2]
+
+        match = self.search(registrable)
+        if match and match["distance"] > 0 and not self._plausible_typosquat(registrable, match, host, labels):
+            match = None
+        if match:
+            suffix = labels[-1]
+            if match["distance"] > 0:
+                technique = "typosquat"
+            elif registrable != split_domain(match["brand"])[-2]:
+                technique = "homoglyph"
+            elif suffix in _HOSTING_SUFFIXES:
+                # e.g. paypal.github.io: a customer site named after the brand
+                technique = "brand_in_subdomain"
+            elif len(suffix.split(".")[-1]) == 2 and suffix.split(".")[-1] not in RISKY_TLDS:
+                # The brand's own name under a country-code TLD, most likely the brand's local site
+                return None
+            else:
+                # Same name under another suffix: weak on its own
+                technique = "suffix_swap"
+            score = LOOKALIKE_SCORES[technique]
+            if technique == "typosquat":
+                score = typosquat_score(match["distance"], len(skeleton(split_domain(match["brand"])[-2])))
+            return {**match, "technique": technique, "label": registrable, "score": score}
+
+        tokens = registrable.split("-")
+        for token in tokens if len(tokens) > 1 else []:
+            skel = skeleton(token)
+            if skel in self._by_skeleton:
+                return {"brand": self._by_skeleton[skel][0], "distance": 0, "technique": "combosquat",
+                        "label": registrable, "score": LOOKALIKE_SCORES["combosquat"]}
+
+        for label in labels[:-2]:
+            skel = skeleton(label)
+            if skel in self._by_skeleton:
+                return {"brand": self._by_skeleton[skel][0], "distance": 0, "technique": "brand_in_subdomain",
+                        "label": label, "score": LOOKALIKE_SCORES["brand_in_subdomain"]}
+        return None
+
+
+_index: Optional[BrandIndex] = None
+_index_lock = threading.Lock()
+
+
+def load_brand_domains(path: Optional[str] = PROTECTED_BRANDS_FILE) -> List[str]:
+    domains = list(DEFAULT_PROTECTED_DOMAINS)
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.split("#", 1)[0].strip()
+                    if line:
+                        domains.append(line)
+        except Exception as e:
+            logger.error(f"Could not read protected brands file {path}: {str(e)}")
+    return domains
+
+
+def get_brand_index() -> BrandIndex:
+    """Build the brand index once per process."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = BrandIndex(load_brand_domains())
+                logger.info(f"Brand index loaded with {len(_index)} protected domains")
+    return _index
+
+
+def reload_brand_index() -> BrandIndex:
+    """Rebuild the brand index, e.g. after PROTECTED_BRANDS_FILE changed."""
+    global _index
+    index = BrandIndex(load_brand_domains())
+    with _index_lock:
+        _index = index
+    logger.info(f"Brand index reloaded with {len(index)} protected domains")
+    return index
+
+
+def check_lookalike(host: str) -> Optional[Dict[str, Any]]:
+    """Lookalike match for host against the protected brand index, or None."""
+    try:
+        return get_brand_index().check_host(host)
+    except Exception as e:
+        logger.error(f"Brand lookalike check error: {str(e)}")
+        return None
+
+
+def describe_lookalike(match: Dict[str, Any]) -> str:
+    techniques = {
+        "homoglyph": "Lookalike characters imitating",
+        "typosquat": "Misspelled domain imitating",
+        "suffix_swap": "Brand name under a different domain suffix than",
+        "combosquat": "Domain combines the brand name of",
+        "brand_in_subdomain": "Subdomain impersonates",
+    }
+    return f"{techniques.get(match['technique'], 'Lookalike of')} {match['brand']}"
@@ -0,0 +1,230 @@
+"""
+Deception Campaign Clustering
+-----------------------------
+This module groups near-identical deception events into campaigns:
+- MinHash signatures over title/summary words and threat_source character
+  shingles (template boilerplate words are ignored)
+- Locality-sensitive hashing (banded signatures) so a new event is only
+  compared with clusters sharing at least one band, not with every event
+- Incremental: each event is assigned a cluster id when it is logged
+
+Clusters live in memory by default. When MongoDB is configured, LSH buckets
+and cluster summaries are stored in the `deception_lsh` and
+`deception_clusters` collections so all workers share them.
+"""
+
+import os
+import re
+import random
+import hashlib
+import logging
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Set
+
+logger = logging.getLogger("campaign_clusters")
+
+NUM_BANDS = 20
+ROWS_PER_BAND = 3
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+CAMPAIGN_SIMILARITY = float(os.getenv("CAMPAIGN_SIMILARITY", "0.5"))  # estimated Jaccard to join a cluster
+MAX_MEMORY_CLUSTERS = int(os.getenv("MAX_MEMORY_CLUSTERS", "5000"))
+MAX_SAMPLE_IDS = 10
+HOST_WEIGHT = 8
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1337)  # fixed seed: signatures must be stable across workers and restarts
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+# Generic words (and the extension's event template) that say nothing about the campaign
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "to", "of", "in", "on", "for", "is", "are", "was", "be", "this",
+    "that", "with", "your", "you", "it", "at", "by", "from", "as", "may", "digital", "fortress",
+    "blocked", "access", "suspicious", "website", "site", "potential", "security", "threat", "detected",
+    "activity", "link", "url", "proceed", "caution",
+}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _normalize_source(threat_source: str) -> str:
+    source = (threat_source or "").lower()
+    source = re.sub(r"^[a-z][a-z0-9+.-]*://", "", source)
+    if source.startswith("www."):
+        source = source[4:]
+    return re.sub(r"\d+", "0", source)  # ids and tracking numbers vary within a campaign
+
+
+def shingles(event: Dict[str, Any]) -> Set[str]:
+    """Feature set of an event for MinHash."""
+    text = f"{event.get('title') or ''} {event.get('summary') or ''}".lower()
+    features = {f"w:{w}" for w in _WORD_RE.findall(text) if w not in _STOPWORDS}
+    source = event.get("threat_source")
+    if isinstance(source, str) and source.lower() != "unknown":
+        source = _normalize_source(source)
+        features |= {f"s:{source[i:i + 3]}" for i in range(max(1, len(source) - 2))}
+        # Replicate the host so short hostnames still outweigh shared verdict wording
+        host = re.split(r"[/?#:]", source, 1)[0]
+        features |= {f"h{i}:{host}" for i in range(HOST_WEIGHT)}
+    if event.get("type"):
+        features.add(f"t:{str(event['type']).lower()}")
+    return features
+
+
+def minhash(features: Set[str]) -> List[int]:
+    """MinHash signature with NUM_PERM universal-hash permutations."""
+    if not features:
+        return [_MERSENNE_PRIME] * NUM_PERM
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big") for f in features]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature: List[int]) -> List[str]:
+    keys = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(repr(rows).encode("ascii"), digest_size=8).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+def _snapshot(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "event_id": event.get("_id"),
+        "title": event.get("title"),
+        "summary": event.get("summary"),
+        "type": event.get("type"),
+        "threat_source": event.get("threat_source"),
+        "severity": event.get("severity", "Medium"),
+    }
+
+
+class MemoryClusterIndex:
+    """In-process LSH index and cluster summaries, bounded to MAX_MEMORY_CLUSTERS."""
+
+    def __init__(self, max_clusters: int = MAX_MEMORY_CLUSTERS):
+        self.max_clusters = max_clusters
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, str] = {}  # band key -> cluster id
+        self._clusters: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # most recent last
+
+    def assign(self, event: Dict[str, Any], signature: List[int]) -> str:
+        keys = band_keys(signature)
+        now = event.get("timestamp")
+        with self._lock:
+            candidates = {self._buckets[k] for k in keys if k in self._buckets}
+            best, best_sim = None, CAMPAIGN_SIMILARITY
+            for cid in candidates:
+                sim = similarity(signature, self._clusters[cid]["signature"])
+                if sim >= best_sim:
+                    best, best_sim = cid, sim
+
+            if best is None:
+                best = f"c-{uuid4().hex[:12]}"
+                self._clusters[best] = {
+                    "signature": signature, "band_keys": set(), "count": 0,
+                    "first_seen": now, "sample_ids": [],
+                }
+            cluster = self._clusters[best]
+            cluster["count"] += 1
+            cluster["last_seen"] = now
+            cluster["latest"] = _snapshot(event)
+            cluster["sample_ids"] = ([event.get("_id")] + cluster["sample_ids"])[:MAX_SAMPLE_IDS]
+            for k in keys:
+                if self._buckets.setdefault(k, best) == best:
+                    cluster["band_keys"].add(k)
+            self._clusters.move_to_end(best)
+
+            while len(self._clusters) > self.max_clusters:
+                _, evicted = self._clusters.popitem(last=False)
+                for k in evicted["band_keys"]:
+                    self._buckets.pop(k, None)
+            return best
+
+    def list(self, skip: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            recent = list(reversed(self._clusters.items()))[skip:skip + limit]
+            return [_public_cluster(cid, c) for cid, c in recent]
+
+
+def _public_cluster(cluster_id: str, cluster: Dict[str, Any]) -> Dict[str, Any]:
+    latest = cluster.get("latest") or {}
+    return {
+        "cluster_id": cluster_id,
+        "count": cluster.get("count", 0),
+        "first_seen": cluster.get("first_seen"),
+        "last_seen": cluster.get("last_seen"),
+        "title": latest.get("title"),
+        "summary": latest.get("summary"),
+        "type": latest.get("type"),
+        "threat_source": latest.get("threat_source"),
+        "severity": latest.get("severity", "Medium"),
+        "sample_ids": [str(i) for i in cluster.get("sample_ids", [])],
+    }
+
+
+MEMORY_CLUSTERS = MemoryClusterIndex()
+_mongo_indexes_ready = False
+
+
+def _assign_mongo(db, event: Dict[str, Any], signature: List[int]) -> str:
+    from pymongo import UpdateOne  # type: ignore
+
+    global _mongo_indexes_ready
+    if not _mongo_indexes_ready:
+        db.deception_clusters.create_index("last_seen")
+        _mongo_indexes_ready = True
+
+    keys = band_keys(signature)
+    candidates = {b["cluster_id"] for b in db.deception_lsh.find({"_id": {"$in": keys}}, {"cluster_id": 1})}
+    best, best_sim = None, CAMPAIGN_SIMILARITY
+    if candidates:
+        for c in db.deception_clusters.find({"_id": {"$in": list(candidates)}}, {"signature": 1}):
+            # int(): clusters created by earlier versions stored the signature as strings
+            sim = similarity(signature, [int(x) for x in c.get("signature", [])])
+            if sim >= best_sim:
+                best, best_sim = c["_id"], sim
+
+    cluster_id = best or f"c-{uuid4().hex[:12]}"
+    db.deception_clusters.update_one(
+        {"_id": cluster_id},
+        {
+            "$inc": {"count": 1},
+            "$set": {"last_seen": event.get("timestamp"), "latest": _snapshot(event)},
+            "$setOnInsert": {"first_seen": event.get("timestamp"), "signature": signature},
+            "$push": {"sample_ids": {"$each": [event.get("_id")], "$position": 0, "$slice": MAX_SAMPLE_IDS}},
+        },
+        upsert=True,
+    )
+    db.deception_lsh.bulk_write(
+        [UpdateOne({"_id": k}, {"$setOnInsert": {"cluster_id": cluster_id}}, upsert=True) for k in keys],
+        ordered=False,
+    )
+    return cluster_id
+
+
+def assign_cluster(event: Dict[str, Any], db=None) -> Optional[str]:
+    """Compute the event's campaign cluster id (creating a cluster if needed)."""
+    try:
+        signature = minhash(shingles(event))
+        if db is not None:
+            return _assign_mongo(db, event, signature)
+        return MEMORY_CLUSTERS.assign(event, signature)
+    except Exception as e:
+        logger.error(f"Campaign clustering error: {str(e)}")
+        return None
+
+
+def list_clusters(db=None, skip: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+    """Campaigns ordered by most recent activity."""
+    if db is not None:
+        cursor = (
+            db.deception_clusters.find({}, {"signature": 0}).sort("last_seen", -1).skip(skip).limit(limit)
+        )
+        return [_public_cluster(str(c.get("_id")), c) for c in cursor]
+    return MEMORY_CLUSTERS.list(skip, limit)
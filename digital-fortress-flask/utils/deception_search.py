@@ -0,0 +1,186 @@
+"""
+Deception Event Search
+----------------------
+This module provides keyword search over logged deception events:
+- Terms come from title, summary, type and the threat_source host
+- Every query word matches as a prefix ("payp" finds "paypal"); all query
+  words must match
+- Results are newest first, paged with skip/limit
+- The index is updated incrementally as each event is logged
+
+The in-memory store uses an inverted index (term -> event sequence numbers) with a sorted
+vocabulary, so a prefix expands to a contiguous range of terms. With MongoDB
+the terms are stored on each event (`search_terms`) under a multikey index,
+and prefixes become anchored regexes that scan only the matching index range.
+"""
+
+import re
+import bisect
+import logging
+import threading
+from urllib.parse import urlparse
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+logger = logging.getLogger("deception_search")
+
+MAX_QUERY_TERMS = 8
+BACKFILL_BATCH = 1000
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _host(threat_source: Any) -> str:
+    if not isinstance(threat_source, str) or threat_source.lower() == "unknown":
+        return ""
+    source = threat_source.strip().lower()
+    if "://" not in source:
+        source = f"http://{source}"
+    try:
+        return urlparse(source).hostname or ""
+    except ValueError:
+        return ""
+
+
+def search_terms(event: Dict[str, Any]) -> List[str]:
+    """Index terms of an event."""
+    text = " ".join(str(event.get(f) or "") for f in ("title", "summary", "type")).lower()
+    terms = {w for w in _WORD_RE.findall(text) if len(w) > 1}
+    terms.update(_WORD_RE.findall(_host(event.get("threat_source"))))
+    return sorted(terms)
+
+
+def query_terms(q: str) -> List[str]:
+    """Normalized query words; single characters are ignored."""
+    words = [w for w in _WORD_RE.findall((q or "").lower()) if len(w) > 1]
+    return list(dict.fromkeys(words))[:MAX_QUERY_TERMS]
+
+
+class MemorySearchIndex:
+    """Inverted index over the in-memory deception store."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._postings: Dict[str, Set[int]] = {}  # term -> event sequence numbers
+        self._vocab: List[str] = []  # sorted terms, for prefix ranges
+        self._events: Dict[int, Tuple[Dict[str, Any], List[str]]] = {}  # seq -> (event, terms)
+        # id(event) -> seq; event ids can repeat (clients may send their own), stored objects cannot
+        self._seq_by_event: Dict[int, int] = {}
+
+    def add(self, event: Dict[str, Any]) -> None:
+        terms = search_terms(event)
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._events[seq] = (event, terms)
+            self._seq_by_event[id(event)] = seq
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is None:
+                    posting = self._postings[term] = set()
+                    bisect.insort(self._vocab, term)
+                posting.add(seq)
+
+    def remove(self, event: Dict[str, Any]) -> None:
+        """Drop an event previously passed to add() (the same object, e.g. when evicted from the store)."""
+        with self._lock:
+            seq = self._seq_by_event.pop(id(event), None)
+            if seq is None:
+                return
+            _, terms = self._events.pop(seq)
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                posting.discard(seq)
+                if not posting:
+                    del self._postings[term]
+                    i = bisect.bisect_left(self._vocab, term)
+                    if i < len(self._vocab) and self._vocab[i] == term:
+                        self._vocab.pop(i)
+
+    def _prefix_matches(self, prefix: str) -> Set[int]:
+        matched: Set[int] = set()
+        i = bisect.bisect_left(self._vocab, prefix)
+        for term in self._vocab[i:]:
+            if not term.startswith(prefix):
+                break
+            matched |= self._postings[term]
+        return matched
+
+    def search(self, terms: List[str], skip: int = 0, limit: int = 20) -> Tuple[List[Dict[str, Any]], bool]:
+        with self._lock:
+            sets = sorted((self._prefix_matches(t) for t in terms), key=len)
+            if not sets:
+                return [], False
+            hits = sets[0].intersection(*sets[1:])
+            ordered = sorted(hits, reverse=True)  # newest first
+            page = [self._events[seq][0] for seq in ordered[skip:skip + limit]]
+            return page, len(ordered) > skip + limit
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+MEMORY_SEARCH = MemorySearchIndex()
+_mongo_ready = False
+_mongo_lock = threading.Lock()
+
+
+def _backfill_mongo(db) -> None:
+    """Add search_terms to events logged before the index existed."""
+    from pymongo import UpdateOne  # type: ignore
+
+    fields = {"title": 1, "summary": 1, "type": 1, "threat_source": 1}
+    try:
+        while True:
+            batch = list(db.deceptions.find({"search_terms": {"$exists": False}}, fields).limit(BACKFILL_BATCH))
+            if not batch:
+                break
+            db.deceptions.bulk_write(
+                [UpdateOne({"_id": d["_id"]}, {"$set": {"search_terms": search_terms(d)}}) for d in batch],
+                ordered=False,
+            )
+        logger.info("Deception search backfill complete")
+    except Exception as e:
+        logger.error(f"Deception search backfill error: {str(e)}")
+
+
+def _ensure_mongo(db) -> None:
+    global _mongo_ready
+    if _mongo_ready:
+        return
+    with _mongo_lock:
+        if _mongo_ready:
+            return
+        db.deceptions.create_index("search_terms")
+        db.deceptions.create_index("timestamp")
+        threading.Thread(target=_backfill_mongo, args=(db,), name="deception-search-backfill", daemon=True).start()
+        _mongo_ready = True
+
+
+def index_event(event: Dict[str, Any], db=None) -> Optional[List[str]]:
+    """Index a newly logged event. With MongoDB, returns the terms to store on the document."""
+    try:
+        if db is None:
+            MEMORY_SEARCH.add(event)
+            return None
+        _ensure_mongo(db)
+    except Exception as e:
+        logger.error(f"Deception search indexing error: {str(e)}")
+    return search_terms(event) if db is not None else None
+
+
+def search(q: str, db=None, skip: int = 0, limit: int = 20) -> Tuple[List[Dict[str, Any]], bool]:
+    """Published events matching every query word as a prefix: (events, has_more)."""
+    terms = query_terms(q)
+    if not terms:
+        return [], False
+    if db is not None:
+        _ensure_mongo(db)
+        query = {
+            "status": "published",
+            "$and": [{"search_terms": {"$regex": f"^{re.escape(t)}"}} for t in terms],
+        }
+        docs = list(db.deceptions.find(query, {"search_terms": 0}).sort("timestamp", -1).skip(skip).limit(limit + 1))
+        return docs[:limit], len(docs) > limit
+    return MEMORY_SEARCH.search(terms, skip, limit)
@@ -0,0 +1,171 @@
+"""
+Deception Statistics
+--------------------
+This module keeps rolling counters of deception events so dashboards never
+scan the event list:
+- Time buckets per minute, hour and day
+- Counts by type, severity and source within each bucket
+- Updated incrementally as each event is logged
+- Queries read only the buckets in the requested window (O(buckets))
+
+Counters live in Redis hashes (STATS_REDIS_URL / REDIS_URL) when configured,
+otherwise in MongoDB (`deception_stats`, `$inc` upserts) when a database is
+passed in, otherwise in memory.
+"""
+
+import os
+import logging
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger("deception_stats")
+
+# granularity -> (bucket length, buckets retained)
+GRANULARITIES = {
+    "minute": (timedelta(minutes=1), 24 * 60),
+    "hour": (timedelta(hours=1), 30 * 24),
+    "day": (timedelta(days=1), 365),
+}
+DIMENSIONS = ("type", "severity", "source")
+
+_redis = None
+_redis_url = os.getenv("STATS_REDIS_URL") or os.getenv("REDIS_URL")
+if _redis_url:
+    try:
+        import redis  # type: ignore
+        _redis = redis.from_url(_redis_url, decode_responses=True)
+    except Exception:
+        _redis = None
+
+_lock = threading.Lock()
+_MEMORY: Dict[str, "OrderedDict[str, Counter]"] = {g: OrderedDict() for g in GRANULARITIES}
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _field(dimension: str, value: Any) -> str:
+    # Mongo field paths cannot contain "." or start with "$"
+    value = str(value if value not in (None, "") else "Unknown").replace(".", "_").lstrip("$")
+    return f"{dimension}:{value}"
+
+
+def _event_fields(event: Dict[str, Any]) -> List[str]:
+    return ["total"] + [
+        _field("source", (event.get("metadata") or {}).get("source")) if dim == "source" else _field(dim, event.get(dim))
+        for dim in DIMENSIONS
+    ]
+
+
+def record_event(event: Dict[str, Any], db=None, now: Optional[datetime] = None) -> None:
+    """Increment every bucket and dimension counter for one event."""
+    now = now or datetime.utcnow()
+    fields = _event_fields(event)
+    try:
+        if _redis is not None:
+            pipe = _redis.pipeline(transaction=False)
+            for granularity, (length, retained) in GRANULARITIES.items():
+                key = f"deception_stats:{granularity}:{bucket_start(now, granularity).isoformat()}"
+                for f in fields:
+                    pipe.hincrby(key, f, 1)
+                pipe.expire(key, int((length * (retained + 1)).total_seconds()))
+            pipe.execute()
+            return
+    except Exception as e:
+        logger.error(f"Redis stats update failed, falling back: {str(e)}")
+
+    if db is not None:
+        try:
+            for granularity in GRANULARITIES:
+                start = bucket_start(now, granularity)
+                db.deception_stats.update_one(
+                    {"_id": f"{granularity}:{start.isoformat()}"},
+                    {
+                        "$inc": {f.replace(":", ".", 1): 1 for f in fields},
+                        "$setOnInsert": {"granularity": granularity, "start": start},
+                    },
+                    upsert=True,
+                )
+            return
+        except Exception as e:
+            logger.error(f"Mongo stats update failed, falling back: {str(e)}")
+
+    with _lock:
+        for granularity, (_, retained) in GRANULARITIES.items():
+            buckets = _MEMORY[granularity]
+            start = bucket_start(now, granularity).isoformat()
+            if start not in buckets:
+                buckets[start] = Counter()
+                while len(buckets) > retained:
+                    buckets.popitem(last=False)
+            buckets[start].update(fields)
+
+
+def _flatten_mongo(doc: Dict[str, Any]) -> Counter:
+    counts: Counter = Counter()
+    for key, value in doc.items():
+        if key == "total":
+            counts["total"] = value
+        elif key in DIMENSIONS and isinstance(value, dict):
+            for name, n in value.items():
+                counts[f"{key}:{name}"] = n
+    return counts
+
+
+def _read_buckets(starts: List[str], granularity: str, db=None) -> List[Counter]:
+    try:
+        if _redis is not None:
+            pipe = _redis.pipeline(transaction=False)
+            for start in starts:
+                pipe.hgetall(f"deception_stats:{granularity}:{start}")
+            return [Counter({k: int(v) for k, v in h.items()}) for h in pipe.execute()]
+    except Exception as e:
+        logger.error(f"Redis stats read failed, falling back: {str(e)}")
+
+    if db is not None:
+        try:
+            ids = [f"{granularity}:{s}" for s in starts]
+            docs = {d["_id"]: d for d in db.deception_stats.find({"_id": {"$in": ids}})}
+            return [_flatten_mongo(docs.get(i, {})) for i in ids]
+        except Exception as e:
+            logger.error(f"Mongo stats read failed, falling back: {str(e)}")
+
+    with _lock:
+        buckets = _MEMORY[granularity]
+        return [Counter(buckets.get(s, {})) for s in starts]
+
+
+def _breakdown(counts: Counter) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"total": counts.get("total", 0)}
+    for dim in DIMENSIONS:
+        prefix = f"{dim}:"
+        out[f"by_{dim}"] = {k[len(prefix):]: v for k, v in counts.items() if k.startswith(prefix)}
+    return out
+
+
+def get_stats(granularity: str = "hour", window: int = 24, db=None, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Counts for the last `window` buckets (including the current one) plus window totals."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    length, retained = GRANULARITIES[granularity]
+    window = max(1, min(window, retained))
+    current = bucket_start(now or datetime.utcnow(), granularity)
+    starts = [(current - length * i).isoformat() for i in range(window - 1, -1, -1)]
+
+    buckets = _read_buckets(starts, granularity, db)
+    totals: Counter = Counter()
+    for counts in buckets:
+        totals.update(counts)
+    return {
+        "granularity": granularity,
+        "window": window,
+        "totals": _breakdown(totals),
+        "buckets": [{"start": s, **_breakdown(c)} for s, c in zip(starts, buckets)],
+    }
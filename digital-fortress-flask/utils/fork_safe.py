@@ -0,0 +1,52 @@
+"""
+Fork-Safe Background Workers
+----------------------------
+Threads do not survive fork: a gunicorn worker forked from the preloaded
+master inherits the master's thread and pool objects, but none of their
+running threads. This module creates such objects lazily, once per process:
+- `ProcessLocal` builds a value with a factory on first use in each process
+  (and again if an optional liveness check fails)
+- `thread_pool` is a ProcessLocal ThreadPoolExecutor
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ProcessLocal(Generic[T]):
+    """A value created on first use in each process."""
+
+    def __init__(self, factory: Callable[[], T], alive: Optional[Callable[[T], bool]] = None):
+        self._factory = factory
+        self._alive = alive
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._pid: Optional[int] = None
+
+    def _valid(self) -> bool:
+        return (
+            self._value is not None and self._pid == os.getpid()
+            and (self._alive is None or self._alive(self._value))
+        )
+
+    def get(self) -> T:
+        if self._valid():
+            return self._value
+        with self._lock:
+            if not self._valid():
+                self._value = self._factory()
+                self._pid = os.getpid()
+            return self._value
+
+    def peek(self) -> Optional[T]:
+        """The value created in this process, or None; never creates one."""
+        return self._value if self._value is not None and self._pid == os.getpid() else None
+
+
+def thread_pool(max_workers: int, name: str) -> "ProcessLocal[ThreadPoolExecutor]":
+    """Per-process ThreadPoolExecutor; call `.get()` to obtain this process's pool."""
+    return ProcessLocal(lambda: ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name))
@@ -2,7 +2,8 @@
 Fraud Detection Enrichment Module
 ---------------------------------
 This module provides external API integrations for fraud detection:
-- Google Safe Browsing API
+- Redirect resolution so shortened links are checked at their destination
+- Google Safe Browsing API (local hash-prefix database, Lookup API fallback)
 - PhishTank / OpenPhish
 - WHOIS / RDAP for domain age
 - Caching system for API results
@@ -17,6 +18,13 @@ from datetime import datetime, timedelta
 from urllib.parse import urlparse
 import requests
 from typing import Dict, List, Any, Optional, Tuple
+from utils.known_bad_filter import record_reputation_result
+from utils.brand_index import check_lookalike, describe_lookalike
+from utils.persistent_cache import PersistentCache
+from utils.tracing import span
+from utils.micro_batch import MicroBatcher
+from utils.redirect_resolver import resolve_urls
+from utils.safe_browsing_local import SAFE_BROWSING_API_BASE, get_local_db, local_db_stats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,13 +33,25 @@ logger = logging.getLogger("fraud_enrichment")
 # Initialize cache
 URL_CACHE = {}  # URL -> {result: dict, timestamp: float}
 CACHE_TTL = 60 * 60  # 1 hour in seconds
+_PERSISTENT_CACHE = PersistentCache("url_enrichment")  # on-disk snapshot used to warm URL_CACHE
+SAFE_BROWSING_LOCAL_DB = os.getenv("SAFE_BROWSING_LOCAL_DB", "true").lower() in ("1", "true", "yes")
 
 # Extract URLs from text
+_URL_PATTERN = re.compile(r'https?://[^\s<>"\'`]+', re.IGNORECASE)
+_TRAILING_PUNCTUATION = '.,;:!?\'"'
+_CLOSING_BRACKETS = {")": "(", "]": "[", "}": "{"}
+
 def extract_urls(text: str) -> List[str]:
-    """Extract URLs from text content."""
-    # URL regex pattern
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+'
-    return re.findall(url_pattern, text)
+    """Extract full URLs (host, path, query) from text content."""
+    urls = []
+    for url in _URL_PATTERN.findall(text):
+        # Drop sentence punctuation and closing brackets that are not part of the URL
+        while url and (url[-1] in _TRAILING_PUNCTUATION or
+                       (url[-1] in _CLOSING_BRACKETS and url.count(url[-1]) > url.count(_CLOSING_BRACKETS[url[-1]]))):
+            url = url[:-1]
+        if urlparse(url).hostname:
+            urls.append(url)
+    return urls
 
 # Cache management
 def get_cached_result(url: str) -> Optional[Dict]:
@@ -44,10 +64,25 @@ def get_cached_result(url: str) -> Optional[Dict]:
 
 def cache_result(url: str, result: Dict) -> None:
     """Cache result for a URL."""
+    now = time.time()
     URL_CACHE[url] = {
         "result": result,
-        "timestamp": time.time()
+        "timestamp": now
     }
+    _PERSISTENT_CACHE.put(url, result, now + CACHE_TTL)
+    record_reputation_result(url, result)
+
+def warm_cache() -> int:
+    """Pre-warm URL_CACHE from the persistent snapshot; returns entries loaded."""
+    loaded = 0
+    for url, result, expires_at in _PERSISTENT_CACHE.load():
+        if url not in URL_CACHE:
+            URL_CACHE[url] = {"result": result, "timestamp": expires_at - CACHE_TTL}
+            record_reputation_result(url, result)
+            loaded += 1
+    if loaded:
+        logger.info(f"Warmed URL cache with {loaded} persisted results")
+    return loaded
 
 def get_cache_stats() -> Dict:
     """Get statistics about the cache."""
@@ -57,14 +92,11 @@ def get_cache_stats() -> Dict:
     }
 
 # Google Safe Browsing API
-def check_google_safe_browsing(url: str) -> Dict:
-    """Check URL against Google Safe Browsing API."""
+def _threat_matches_batch(urls: List[str]) -> Dict[str, Dict]:
+    """One threatMatches:find call for up to SAFE_BROWSING_BATCH_SIZE URLs."""
     api_key = os.getenv("GOOGLE_SAFE_BROWSING_KEY")
-    if not api_key:
-        return {"status": "skipped", "reason": "API key not configured"}
-    
     try:
-        endpoint = f"https://safebrowsing.googleapis.com/v4/threatMatches:find?key={api_key}"
+        endpoint = f"{SAFE_BROWSING_API_BASE}/threatMatches:find?key={api_key}"
         payload = {
             "client": {
                 "clientId": "digital-fortress",
@@ -74,22 +106,62 @@ def check_google_safe_browsing(url: str) -> Dict:
                 "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
                 "platformTypes": ["ANY_PLATFORM"],
                 "threatEntryTypes": ["URL"],
-                "threatEntries": [{"url": url}]
+                "threatEntries": [{"url": url} for url in urls]
             }
         }
         
         response = requests.post(endpoint, json=payload, timeout=1.5)
         if response.status_code == 200:
-            result = response.json()
-            if "matches" in result and len(result["matches"]) > 0:
-                threat_type = result["matches"][0]["threatType"]
-                return {"status": "unsafe", "threat_type": threat_type, "score": 100}
-            return {"status": "safe", "score": 0}
+            results = {url: {"status": "safe", "score": 0} for url in urls}
+            for match in response.json().get("matches", []):
+                url = (match.get("threat") or {}).get("url")
+                if url in results and results[url]["status"] == "safe":
+                    results[url] = {"status": "unsafe", "threat_type": match.get("threatType"), "score": 100}
+            return results
         else:
-            return {"status": "error", "reason": f"API returned status {response.status_code}"}
+            error = {"status": "error", "reason": f"API returned status {response.status_code}"}
     except Exception as e:
         logger.error(f"Google Safe Browsing API error: {str(e)}")
-        return {"status": "error", "reason": str(e)}
+        error = {"status": "error", "reason": str(e)}
+    return {url: error for url in urls}
+
+# Lookups from concurrent requests share threatMatches:find calls
+SAFE_BROWSING_BATCHER = MicroBatcher(
+    "safe_browsing",
+    _threat_matches_batch,
+    max_batch=int(os.getenv("SAFE_BROWSING_BATCH_SIZE", "500")),
+    max_wait_ms=float(os.getenv("SAFE_BROWSING_BATCH_WINDOW_MS", "5")),
+)
+
+def check_google_safe_browsing_batch(urls: List[str]) -> Dict[str, Dict]:
+    """Check several URLs against Google Safe Browsing with batched API calls."""
+    api_key = os.getenv("GOOGLE_SAFE_BROWSING_KEY")
+    if not api_key:
+        return {url: {"status": "skipped", "reason": "API key not configured"} for url in urls}
+    if not urls:
+        return {}
+
+    # Local hash-prefix database: only prefix hits reach the API
+    if SAFE_BROWSING_LOCAL_DB:
+        local_db = get_local_db(api_key)
+        if local_db.ready:
+            return local_db.lookup_many(urls)
+
+    return SAFE_BROWSING_BATCHER.get_many(
+        urls,
+        timeout=SAFE_BROWSING_BATCHER.max_wait + 2.0,
+        default=lambda reason: {"status": "error", "reason": reason},
+    )
+
+def check_google_safe_browsing(url: str) -> Dict:
+    """Check URL against Google Safe Browsing API."""
+    return check_google_safe_browsing_batch([url])[url]
+
+def preload_safe_browsing() -> None:
+    """Load or sync the local Safe Browsing lists in the calling thread (e.g. before workers fork)."""
+    api_key = os.getenv("GOOGLE_SAFE_BROWSING_KEY")
+    if api_key and SAFE_BROWSING_LOCAL_DB:
+        get_local_db(api_key, background=False)
 
 # PhishTank / OpenPhish API
 def check_phishtank(url: str) -> Dict:
@@ -252,18 +324,21 @@ def check_virustotal(url: str) -> Dict:
         return {"status": "error", "reason": str(e)}
 
 # Main enrichment function
-def enrich_fraud_detection(text: str) -> Dict:
+def enrich_fraud_detection(text: str, local_only: bool = False) -> Dict:
     """
     Enrich fraud detection with external API checks.
     
     Args:
         text: The text to analyze for fraud
+        local_only: Skip external APIs for uncached URLs (load shedding);
+            such results are marked degraded and not cached
         
     Returns:
         Dict containing enriched fraud detection results
     """
     # Extract URLs from text
-    urls = extract_urls(text)
+    with span("extract_urls"):
+        urls = extract_urls(text)
     
     # Initialize results
     results = {
@@ -277,29 +352,61 @@ def enrich_fraud_detection(text: str) -> Dict:
     if not urls:
         return results
     
+    # Check final destinations rather than shorteners and redirectors; under
+    # load shedding only already known redirects are used
+    with span("resolve_redirects"):
+        resolutions = resolve_urls(urls, cached_only=local_only)
+    redirects = {}
+    for url, resolution in resolutions.items():
+        if resolution["final_url"] != url:
+            redirects[resolution["final_url"]] = {"resolved_from": url, "redirect_hops": resolution["hops"]}
+    urls = [resolutions[url]["final_url"] for url in urls]
+    
     # Process each URL
     highest_risk_score = 0
     highest_risk_url = None
     
+    # Check cache first
+    with span("cache_lookup"):
+        cached_results = {url: get_cached_result(url) for url in urls}
+    
+    # One batched Safe Browsing lookup for every uncached URL
+    google_results = {}
+    if not local_only:
+        with span("provider.google_safe_browsing"):
+            google_results = check_google_safe_browsing_batch(
+                list(dict.fromkeys(url for url in urls if not cached_results[url]))
+            )
+    
     for url in urls:
-        # Check cache first
-        cached_result = get_cached_result(url)
+        cached_result = cached_results[url]
         if cached_result:
             results["cached"] = True
             url_result = cached_result
         else:
-            # Run all checks sequentially
-            google_result = check_google_safe_browsing(url)
-            phishtank_result = check_phishtank(url)
-            domain_age_result = check_domain_age(url)
-            virustotal_result = check_virustotal(url)
+            if local_only:
+                skipped = {"status": "skipped", "reason": "External checks deferred under load"}
+                google_result = phishtank_result = domain_age_result = virustotal_result = skipped
+                results["degraded"] = True
+            else:
+                # Run remaining checks sequentially
+                google_result = google_results[url]
+                with span("provider.phishtank"):
+                    phishtank_result = check_phishtank(url)
+                with span("provider.domain_age"):
+                    domain_age_result = check_domain_age(url)
+                with span("provider.virustotal"):
+                    virustotal_result = check_virustotal(url)
+            with span("brand_lookalike"):
+                lookalike_result = check_lookalike(urlparse(url).hostname or "")
             
             # Calculate weighted score
             local_heuristic_score = 0  # Will be filled by the main app
             reputation_score = max(
                 google_result.get("score", 0),
                 phishtank_result.get("score", 0),
-                virustotal_result.get("score", 0)
+                virustotal_result.get("score", 0),
+                (lookalike_result or {}).get("score", 0)
             )
             domain_age_score = domain_age_result.get("score", 0)
             
@@ -310,16 +417,19 @@ def enrich_fraud_detection(text: str) -> Dict:
                 if google_result.get("threat_type"):
                     external_sources["google_safe_browsing"] += f" ({google_result['threat_type']})"
             
-            if phishtank_result.get("status") != "unknown":
+            if phishtank_result.get("status") not in ("unknown", "skipped"):
                 external_sources["phishtank"] = phishtank_result.get("status", "unknown")
             
-            if domain_age_result.get("status") != "error":
+            if domain_age_result.get("status") not in ("error", "skipped"):
                 external_sources["whois"] = domain_age_result.get("note", "unknown")
             
             if virustotal_result.get("status") != "skipped":
                 if virustotal_result.get("malicious", 0) > 0:
                     external_sources["virustotal"] = f"{virustotal_result.get('malicious', 0)} detections"
             
+            if lookalike_result:
+                external_sources["brand_lookalike"] = describe_lookalike(lookalike_result)
+            
             # Store URL result
             url_result = {
                 "url": url,
@@ -330,12 +440,14 @@ def enrich_fraud_detection(text: str) -> Dict:
                     "google_safe_browsing": google_result,
                     "phishtank": phishtank_result,
                     "domain_age": domain_age_result,
-                    "virustotal": virustotal_result
+                    "virustotal": virustotal_result,
+                    "brand_lookalike": lookalike_result or {"status": "none"}
                 }
             }
             
-            # Cache the result
-            cache_result(url, url_result)
+            # Cache the result (degraded results would hide real reputation data)
+            if not local_only:
+                cache_result(url, url_result)
         
         # Track highest risk URL
         url_risk = url_result.get("reputation_score", 0) + url_result.get("domain_age_score", 0)
@@ -344,6 +456,8 @@ def enrich_fraud_detection(text: str) -> Dict:
             highest_risk_url = url
         
         # Add to analyzed URLs
+        if url in redirects:
+            url_result = {**url_result, **redirects[url]}
         results["urls_analyzed"].append(url_result)
     
     # Add highest risk URL info
@@ -364,9 +478,14 @@ def get_fraud_stats() -> Dict:
     """Get statistics about fraud detection."""
     return {
         "cache_stats": get_cache_stats(),
+        "safe_browsing_local_db": local_db_stats(),
+        "safe_browsing_batching": SAFE_BROWSING_BATCHER.stats(),
         "api_usage": {
             "google_safe_browsing": {"calls": 0},  # In a real implementation, track API usage
             "phishtank": {"calls": 0},
             "virustotal": {"calls": 0}
         }
-    }
\ No newline at end of file
+    }
+
+# Restore results cached before the last restart
+warm_cache()
@@ -0,0 +1,304 @@
+"""
+Known-Bad Host Filter
+---------------------
+This module maintains a Bloom filter of known-malicious hosts and URLs so the
+browser extension can check navigations offline:
+- Populated from cached reputation results and from threat sources of
+  logged deception events that the server's own URL scoring rates as danger
+- Capped at BLOOM_MAX_CAPACITY keys, so clients cannot grow it without bound
+- Versioned, with delta updates (bit positions set since a client's version)
+- Exposes its hashing scheme so clients compute identical bit positions
+
+A filter hit only means "ask the server": clients still call /api/url_scan to
+get the real verdict, so false positives cost a round trip, never a block.
+
+Keys are stored in the persistent cache's SQLite file, numbered in insertion
+order. Every worker replays that log into its own copy of the filter, so all
+workers agree on the generation, the version (the last key number applied)
+and the bits set since any version, and an extension can send its delta
+sync to any worker. With PERSISTENT_CACHE_PATH empty the log stays in
+process memory and each worker starts its own generation.
+"""
+
+import os
+import math
+import time
+import base64
+import sqlite3
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse
+from typing import Dict, List, Any, Optional, Iterable
+
+from utils.fork_safe import ProcessLocal
+from utils.persistent_cache import PERSISTENT_CACHE_PATH
+
+logger = logging.getLogger("known_bad_filter")
+
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "50000"))
+BLOOM_FP_RATE = float(os.getenv("BLOOM_FP_RATE", "0.001"))
+BLOOM_MAX_CAPACITY = int(os.getenv("BLOOM_MAX_CAPACITY", "400000"))  # keys beyond this are dropped
+BLOOM_MAX_DELTAS = int(os.getenv("BLOOM_MAX_DELTAS", "5000"))  # versions kept for delta updates
+
+# Reputation score (0-100) at or above which a cached enrichment result is "known bad"
+KNOWN_BAD_MIN_SCORE = 70
+
+HASH_SCHEME = {
+    "hash": "sha256",
+    "index": "(h1 + i * h2) mod m for i in 0..k-1",
+    "h1": "uint32 big-endian from digest bytes 0-3",
+    "h2": "uint32 big-endian from digest bytes 4-7",
+    "bit_order": "bit p is (byte[p >> 3] >> (p & 7)) & 1",
+    "keys": {
+        "host": "'h:' + lowercase hostname without trailing dot or leading 'www.'",
+        "url": "'u:' + host key value + path ('/' if empty), no query or fragment",
+    },
+}
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS known_bad (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS known_bad_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def host_key(host: str) -> Optional[str]:
+    """Filter key for a hostname."""
+    host = (host or "").strip().lower().rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    return f"h:{host}" if host else None
+
+
+def url_keys(url: str) -> List[str]:
+    """Filter keys (host and URL) for a URL, per HASH_SCHEME."""
+    try:
+        parsed = urlparse(url if "://" in url else f"http://{url}")
+        hk = host_key(parsed.hostname or "")
+    except Exception:
+        return []
+    # Skip placeholders such as "Unknown" that are not real hostnames
+    if not hk or not ("." in hk[2:] or ":" in hk[2:]):
+        return []
+    return [hk, f"u:{hk[2:]}{parsed.path or '/'}"]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using SHA-256 double hashing."""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+        self.m = max(64, (bits + 7) // 8 * 8)
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray(self.m // 8)
+
+    def positions(self, key: str) -> List[int]:
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[0:4], "big")
+        h2 = int.from_bytes(digest[4:8], "big")
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def set_positions(self, positions: Iterable[int]) -> List[int]:
+        """Set bits and return the positions that were not already set."""
+        new = []
+        for p in positions:
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                new.append(p)
+        return new
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+
+class KnownBadStore:
+    """Append-only log of filter keys in SQLite, shared by every process on the host."""
+
+    def __init__(self, path: str = PERSISTENT_CACHE_PATH):
+        self.path = path
+        self.enabled = bool(path)
+        self.generation = None
+        self._conn: "ProcessLocal[sqlite3.Connection]" = ProcessLocal(self._connect)
+        if self.enabled:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                conn = self._conn.get()
+                with conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO known_bad_meta (name, value) VALUES ('generation', ?)",
+                        (f"{int(time.time() * 1000):x}",),
+                    )
+                self.generation = conn.execute(
+                    "SELECT value FROM known_bad_meta WHERE name = 'generation'"
+                ).fetchone()[0]
+            except Exception as e:
+                logger.error(f"Known-bad store disabled ({path}): {str(e)}")
+                self.enabled = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def add(self, key: str) -> None:
+        conn = self._conn.get()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO known_bad (key) VALUES (?)", (key,))
+
+    def since(self, seq: int) -> List[tuple]:
+        """(seq, key) rows appended after `seq`, in order."""
+        return self._conn.get().execute(
+            "SELECT seq, key FROM known_bad WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+
+class KnownBadFilter:
+    """Versioned Bloom filter with a bounded log of deltas for incremental sync.
+
+    Version numbers are key sequence numbers from the store, so every process
+    replaying the same log reports the same version and deltas.
+    """
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, fp_rate: float = BLOOM_FP_RATE,
+                 store: Optional[KnownBadStore] = None):
+        self._lock = threading.Lock()
+        self._fp_rate = fp_rate
+        self._store = store if store is not None else KnownBadStore()
+        self._keys: List[tuple] = []  # (seq, key) in log order
+        self._seen: set = set()
+        self._synced = 0  # last sequence number read from the store
+        self._pid = None
+        self._check_fork()
+        self._rebuild(min(capacity, BLOOM_MAX_CAPACITY))
+
+    def _check_fork(self) -> None:
+        # Without a shared store a forked worker diverges from its parent with its own adds
+        if not self._store.enabled and self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local_generation = f"{int(time.time() * 1000):x}-{self._pid:x}"
+
+    @property
+    def generation(self) -> str:
+        base = self._store.generation if self._store.enabled else self._local_generation
+        # The filter size is part of the generation: a rebuild at a larger capacity changes every bit
+        return f"{base}-{self.filter.m:x}"
+
+    def _rebuild(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.filter = BloomFilter(capacity, self._fp_rate)
+        self.version = 0
+        self._deltas: List[tuple] = []  # (version, [new bit positions])
+        for seq, key in self._keys:
+            self._apply(seq, key)
+
+    def _apply(self, seq: int, key: str) -> None:
+        new = self.filter.set_positions(self.filter.positions(key))
+        self.version = seq
+        self._deltas.append((seq, new))
+        if len(self._deltas) > BLOOM_MAX_DELTAS:
+            del self._deltas[: len(self._deltas) - BLOOM_MAX_DELTAS]
+
+    def _append(self, rows: Iterable[tuple]) -> None:
+        for seq, key in rows:
+            self._synced = max(self._synced, seq)
+            if key in self._seen or self.full:
+                continue
+            self._seen.add(key)
+            self._keys.append((seq, key))
+            if self.full:
+                logger.warning("Known-bad filter reached BLOOM_MAX_CAPACITY (%d keys)", BLOOM_MAX_CAPACITY)
+            if len(self._keys) > self.capacity:
+                # Over capacity the false-positive rate degrades; the capacity depends only on
+                # the number of keys, so every process rebuilds at the same size
+                capacity = self.capacity
+                while capacity < len(self._keys):
+                    capacity = min(capacity * 2, BLOOM_MAX_CAPACITY)
+                logger.info("Known-bad filter over capacity, rebuilding at %d", capacity)
+                self._rebuild(capacity)
+            else:
+                self._apply(seq, key)
+
+    @property
+    def full(self) -> bool:
+        return len(self._keys) >= BLOOM_MAX_CAPACITY
+
+    def _sync(self) -> None:
+        self._check_fork()
+        if not self._store.enabled:
+            return
+        try:
+            self._append(self._store.since(self._synced))
+        except Exception as e:
+            logger.error(f"Known-bad filter sync error: {str(e)}")
+
+    def add(self, key: str) -> bool:
+        with self._lock:
+            self._sync()
+            if key in self._seen or self.full:
+                return False
+            if not self._store.enabled:
+                self._append([(self._synced + 1, key)])
+                return True
+            try:
+                self._store.add(key)
+            except Exception as e:
+                logger.error(f"Known-bad store write error: {str(e)}")
+                return False
+            self._sync()
+            return key in self._seen
+
+    def add_url(self, url: str) -> None:
+        for key in url_keys(url):
+            self.add(key)
+
+    def might_contain_url(self, url: str) -> bool:
+        with self._lock:
+            self._sync()
+        return any(key in self.filter for key in url_keys(url))
+
+    def export(self, generation: Optional[str] = None, since: Optional[int] = None) -> Dict[str, Any]:
+        """Full filter, or only the bits set after `since` when the client is on this generation."""
+        with self._lock:
+            self._sync()
+            out = {
+                "generation": self.generation,
+                "version": self.version,
+                "m": self.filter.m,
+                "k": self.filter.k,
+                "entries": len(self._keys),
+                "scheme": HASH_SCHEME,
+            }
+            # Versions below the oldest kept delta can no longer be served incrementally
+            floor = self._deltas[0][0] - 1 if self._deltas else self.version
+            if generation == self.generation and since is not None and floor <= since <= self.version:
+                positions = sorted({p for v, ps in self._deltas if v > since for p in ps})
+                out.update({"type": "delta", "since": since, "positions": positions})
+            else:
+                out.update({"type": "full", "bits": base64.b64encode(bytes(self.filter.bits)).decode("ascii")})
+            return out
+
+
+KNOWN_BAD = KnownBadFilter()
+
+
+def record_known_bad_url(url: str) -> None:
+    """Add a URL (and its host) to the known-bad filter."""
+    if url:
+        KNOWN_BAD.add_url(url)
+
+
+def record_reputation_result(url: str, result: Dict) -> None:
+    """Add a URL from an enrichment result if its reputation score marks it as malicious."""
+    if (result or {}).get("reputation_score", 0) >= KNOWN_BAD_MIN_SCORE:
+        record_known_bad_url(url)
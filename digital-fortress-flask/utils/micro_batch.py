@@ -0,0 +1,114 @@
+"""
+Micro-Batching
+--------------
+This module coalesces lookups from concurrent requests into batched upstream
+calls:
+- Callers submit keys and wait on per-key futures
+- A dispatcher thread flushes once `max_batch` keys are pending or the
+  oldest pending key has waited `max_wait_ms`
+- Identical keys submitted by different callers share one batch slot
+- The batch function maps keys to results; each waiter gets its own
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Any, Hashable, Iterable
+
+from utils.fork_safe import ProcessLocal
+
+logger = logging.getLogger("micro_batch")
+
+
+class MicroBatcher:
+    """Collects keys for a few milliseconds and resolves them with one batch call."""
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]],
+                 max_batch: int = 500, max_wait_ms: float = 5.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[Hashable, Future]" = OrderedDict()
+        self._oldest = 0.0
+        self._dispatcher = ProcessLocal(self._start_dispatcher, alive=threading.Thread.is_alive)
+        self.batches = 0
+        self.keys = 0
+
+    def submit(self, keys: Iterable[Hashable]) -> Dict[Hashable, Future]:
+        futures = {}
+        with self._cond:
+            self._dispatcher.get()
+            for key in keys:
+                fut = self._pending.get(key)
+                if fut is None:
+                    if not self._pending:
+                        self._oldest = time.monotonic()
+                    fut = self._pending[key] = Future()
+                futures[key] = fut
+            self._cond.notify()
+        return futures
+
+    def get_many(self, keys: Iterable[Hashable], timeout: float, default: Callable[[str], Any]) -> Dict[Hashable, Any]:
+        """Submit keys and wait for their results; `default(reason)` fills failures."""
+        futures = self.submit(keys)
+        deadline = time.monotonic() + timeout
+        results = {}
+        for key, fut in futures.items():
+            try:
+                results[key] = fut.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                results[key] = default(f"{self.name} batch timed out")
+            except Exception as e:
+                results[key] = default(str(e))
+        return results
+
+    def _start_dispatcher(self) -> threading.Thread:
+        # Keys pending in the parent process have no dispatcher in this one
+        self._pending = OrderedDict()
+        thread = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+        thread.start()
+        return thread
+
+    def _take_batch(self) -> "OrderedDict[Hashable, Future]":
+        with self._cond:
+            while True:
+                if self._pending:
+                    remaining = self._oldest + self.max_wait - time.monotonic()
+                    if len(self._pending) >= self.max_batch or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            batch = OrderedDict()
+            while self._pending and len(batch) < self.max_batch:
+                key, fut = self._pending.popitem(last=False)
+                batch[key] = fut
+            self._oldest = time.monotonic()  # leftovers start a fresh window
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take_batch()
+            self.batches += 1
+            self.keys += len(batch)
+            try:
+                results = self.batch_fn(list(batch))
+            except Exception as e:
+                logger.error(f"{self.name} batch error: {str(e)}")
+                for fut in batch.values():
+                    fut.set_exception(e)
+                continue
+            for key, fut in batch.items():
+                fut.set_result(results.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "keys": self.keys,
+            "avg_batch_size": round(self.keys / self.batches, 2) if self.batches else 0,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,197 @@
+"""
+Persistent Cache Snapshot
+-------------------------
+This module keeps an on-disk copy of the in-memory result caches so worker
+restarts and deploys do not start from an empty cache:
+- SQLite file (WAL mode) shared by all workers on the host
+- Entries stored with their expiry time, per namespace
+- Writes are queued and applied by a background thread in batches
+- Startup loads unexpired entries to pre-warm the in-memory caches
+- Periodic compaction drops expired rows, trims each namespace to a size
+  cap and returns freed pages to the filesystem
+
+Set PERSISTENT_CACHE_PATH to an empty value to disable persistence.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+from utils.fork_safe import ProcessLocal
+
+logger = logging.getLogger("persistent_cache")
+
+PERSISTENT_CACHE_PATH = os.getenv(
+    "PERSISTENT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "result_cache.sqlite3"),
+)
+PERSISTENT_CACHE_MAX_ENTRIES = int(os.getenv("PERSISTENT_CACHE_MAX_ENTRIES", "100000"))  # per namespace
+COMPACT_INTERVAL_SECONDS = 10 * 60
+WRITE_BATCH_SIZE = 500
+WRITE_QUEUE_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    # auto_vacuum only takes effect before the first table is created
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS cache_updated ON cache (namespace, updated_at)")
+    return conn
+
+
+class PersistentCache:
+    """Asynchronously written SQLite snapshot of one in-memory cache namespace."""
+
+    _writer: "ProcessLocal[threading.Thread]"
+    _queue: "queue.Queue" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    _namespaces: Dict[str, "PersistentCache"] = {}
+
+    def __init__(self, namespace: str, path: str = PERSISTENT_CACHE_PATH,
+                 max_entries: int = PERSISTENT_CACHE_MAX_ENTRIES):
+        self.namespace = namespace
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = bool(path)
+        if self.enabled:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                _connect(path).close()
+            except Exception as e:
+                logger.error(f"Persistent cache disabled ({path}): {str(e)}")
+                self.enabled = False
+        PersistentCache._namespaces[namespace] = self
+
+    def load(self) -> List[Tuple[str, Any, float]]:
+        """Unexpired (key, value, expires_at) entries, most recently written first."""
+        if not self.enabled:
+            return []
+        try:
+            conn = _connect(self.path)
+            try:
+                rows = conn.execute(
+                    "SELECT key, value, expires_at FROM cache WHERE namespace = ? AND expires_at > ? "
+                    "ORDER BY updated_at DESC LIMIT ?",
+                    (self.namespace, time.time(), self.max_entries),
+                ).fetchall()
+            finally:
+                conn.close()
+            return [(key, json.loads(value), expires_at) for key, value, expires_at in rows]
+        except Exception as e:
+            logger.error(f"Persistent cache load error ({self.namespace}): {str(e)}")
+            return []
+
+    def put(self, key: str, value: Any, expires_at: float) -> None:
+        """Queue an entry for writing; never blocks the request path."""
+        if not self.enabled:
+            return
+        try:
+            payload = json.dumps(value, default=str)
+            PersistentCache._writer.get()
+            PersistentCache._queue.put_nowait((self.namespace, key, payload, expires_at, time.time()))
+        except queue.Full:
+            pass  # persistence is best-effort; the in-memory cache still has the entry
+        except Exception as e:
+            logger.error(f"Persistent cache put error ({self.namespace}): {str(e)}")
+
+    # --- background writer (one per process) ---
+    @classmethod
+    def _start_writer(cls) -> threading.Thread:
+        cls._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        thread = threading.Thread(target=cls._write_loop, name="persistent-cache-writer", daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def _write_loop(cls) -> None:
+        conns: Dict[str, sqlite3.Connection] = {}
+        last_compact = time.time()
+        q = cls._queue
+        while True:
+            try:
+                batch = [q.get(timeout=COMPACT_INTERVAL_SECONDS)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            by_path: Dict[str, list] = {}
+            for row in batch:
+                cache = cls._namespaces.get(row[0])
+                if cache is not None and cache.enabled:
+                    by_path.setdefault(cache.path, []).append(row)
+            for path, rows in by_path.items():
+                try:
+                    conn = conns.get(path) or conns.setdefault(path, _connect(path))
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, updated_at) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            rows,
+                        )
+                except Exception as e:
+                    logger.error(f"Persistent cache write error: {str(e)}")
+            for _ in batch:
+                q.task_done()
+
+            if time.time() - last_compact >= COMPACT_INTERVAL_SECONDS:
+                last_compact = time.time()
+                cls.compact_all(conns)
+
+    @classmethod
+    def compact_all(cls, conns: Optional[Dict[str, sqlite3.Connection]] = None) -> None:
+        """Drop expired rows, trim namespaces to their cap and release free pages."""
+        conns = conns if conns is not None else {}
+        for cache in list(cls._namespaces.values()):
+            if not cache.enabled:
+                continue
+            try:
+                conn = conns.get(cache.path) or conns.setdefault(cache.path, _connect(cache.path))
+                with conn:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?",
+                                 (cache.namespace, time.time()))
+                    conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND key NOT IN ("
+                        "SELECT key FROM cache WHERE namespace = ? ORDER BY updated_at DESC LIMIT ?)",
+                        (cache.namespace, cache.namespace, cache.max_entries),
+                    )
+                conn.execute("PRAGMA incremental_vacuum")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except Exception as e:
+                logger.error(f"Persistent cache compaction error ({cache.namespace}): {str(e)}")
+
+    @classmethod
+    def flush(cls, timeout: float = 2.0) -> None:
+        """Wait (bounded) for queued writes to reach disk."""
+        if cls._writer.peek() is None:
+            return
+        deadline = time.time() + timeout
+        while cls._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+
+PersistentCache._writer = ProcessLocal(PersistentCache._start_writer, alive=threading.Thread.is_alive)
+atexit.register(PersistentCache.flush)
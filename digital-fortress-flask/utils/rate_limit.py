@@ -0,0 +1,215 @@
+"""
+Inbound Rate Limiting and Load Shedding
+---------------------------------------
+This module protects the scan endpoints from floods:
+- Per-client token buckets, keyed by a configured API key or the client IP
+- Redis-backed buckets (atomic Lua script) shared by all workers when
+  RATE_LIMIT_REDIS_URL / REDIS_URL is set, in-memory buckets otherwise
+- Concurrency gates for slow upstream work: once the in-flight limit is
+  reached, callers get a non-blocking "no" and serve cached or local-only
+  results instead of queueing behind enrichment
+
+Limits are configured per endpoint as "burst,refill_per_second", e.g.
+RATE_LIMIT_DETECT_FRAUD=20,1. Only API keys listed in RATE_LIMIT_API_KEYS get
+their own bucket; any other X-API-Key or X-Extension-Id header is chosen by
+the caller, so those requests are limited by IP.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from typing import Dict, Any, Tuple
+
+from flask import request, jsonify
+
+logger = logging.getLogger("rate_limit")
+
+# endpoint -> (burst capacity, tokens refilled per second)
+DEFAULT_LIMITS = {
+    "detect_fraud": (20, 1.0),
+    "url_scan": (120, 10.0),
+    "auto_wifi_scan": (5, 0.1),
+    "deceptions_log": (30, 0.5),
+}
+MAX_TRACKED_CLIENTS = 100000
+
+
+def _proxy_hops(raw: str) -> int:
+    """TRUST_PROXY: number of reverse proxies in front of the app ("true" means one)."""
+    raw = raw.strip().lower()
+    if raw in ("true", "yes"):
+        return 1
+    return int(raw) if raw.isdigit() else 0
+
+
+# The app wraps itself in werkzeug's ProxyFix with this many hops, so
+# request.remote_addr is the address the nearest trusted proxy saw
+TRUST_PROXY_HOPS = _proxy_hops(os.getenv("TRUST_PROXY", "false"))
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# Digests of the API keys that are trusted to identify a client
+API_KEY_DIGESTS = {
+    _key_digest(k.strip()) for k in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if k.strip()
+}
+
+REDIS_TIMEOUT = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.2"))  # seconds, connect and per command
+REDIS_RETRY_SECONDS = 30  # after a Redis error, use local buckets this long before trying again
+
+_redis = None
+_redis_url = os.getenv("RATE_LIMIT_REDIS_URL") or os.getenv("REDIS_URL")
+if _redis_url:
+    try:
+        import redis  # type: ignore
+        _redis = redis.from_url(
+            _redis_url, decode_responses=True,
+            socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT,
+        )
+    except Exception:
+        _redis = None
+_redis_retry_at = 0.0  # circuit breaker: Redis is skipped until this monotonic time
+
+# KEYS[1] bucket; ARGV: capacity, refill/s, now, cost. Returns {allowed, tokens*1000, retry_after_ms}
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, math.floor(tokens * 1000), retry}
+"""
+_lua = None
+
+
+def get_limit(name: str) -> Tuple[float, float]:
+    raw = os.getenv(f"RATE_LIMIT_{name.upper()}")
+    if raw:
+        try:
+            capacity, rate = (float(x) for x in raw.split(","))
+            return capacity, rate
+        except ValueError:
+            logger.error(f"Invalid RATE_LIMIT_{name.upper()}={raw!r}, using default")
+    return DEFAULT_LIMITS.get(name, (60, 1.0))
+
+
+def client_id() -> str:
+    """Identify the caller: a configured API key, otherwise the IP address."""
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        digest = _key_digest(api_key)
+        if digest in API_KEY_DIGESTS:
+            return f"key:{digest}"
+    return f"ip:{request.remote_addr or 'unknown'}"
+
+
+class MemoryTokenBuckets:
+    """Process-local token buckets with LRU eviction of idle clients."""
+
+    def __init__(self, max_clients: int = MAX_TRACKED_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, ts)
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> Tuple[bool, float, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            allowed = tokens >= cost
+            retry_after = 0.0 if allowed else (cost - tokens) / rate
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return allowed, tokens, retry_after
+
+
+MEMORY_BUCKETS = MemoryTokenBuckets()
+
+
+def take_token(name: str, client: str, cost: float = 1.0) -> Tuple[bool, float, float]:
+    """Consume from the client's bucket for an endpoint: (allowed, remaining, retry_after_seconds)."""
+    global _lua, _redis_retry_at
+    capacity, rate = get_limit(name)
+    key = f"rate_limit:{name}:{client}"
+    if _redis is not None and time.monotonic() >= _redis_retry_at:
+        try:
+            if _lua is None:
+                _lua = _redis.register_script(_TOKEN_BUCKET_LUA)
+            allowed, tokens, retry_ms = _lua(keys=[key], args=[capacity, rate, time.time(), cost])
+            return bool(allowed), int(tokens) / 1000.0, int(retry_ms) / 1000.0
+        except Exception as e:
+            # Fail open to local buckets rather than rejecting traffic when Redis is down, and
+            # stop waiting on Redis for a while so requests are not slowed by repeated timeouts
+            _redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+            logger.error(f"Redis rate limit error, using local buckets for {REDIS_RETRY_SECONDS}s: {str(e)}")
+    return MEMORY_BUCKETS.take(key, capacity, rate, cost)
+
+
+def rate_limited(name: str):
+    """Decorator: reject with 429 when the caller's bucket for `name` is empty."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            allowed, _, retry_after = take_token(name, client_id())
+            if not allowed:
+                retry = max(1, int(retry_after + 0.999))
+                resp = jsonify({"success": False, "error": "Rate limit exceeded", "retry_after": retry})
+                resp.status_code = 429
+                resp.headers["Retry-After"] = str(retry)
+                resp.headers["X-RateLimit-Remaining"] = "0"
+                return resp
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ConcurrencyGate:
+    """Non-blocking limit on concurrent slow operations within a process."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.shed = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": self.in_flight, "limit": self.limit, "shed": self.shed}
+
+
+ENRICHMENT_GATE = ConcurrencyGate("enrichment", int(os.getenv("MAX_INFLIGHT_ENRICHMENT", "8")))
+WIFI_SCAN_GATE = ConcurrencyGate("auto_wifi_scan", int(os.getenv("MAX_INFLIGHT_WIFI_SCANS", "4")))
@@ -0,0 +1,210 @@
+"""
+Redirect Resolution
+-------------------
+This module resolves links (e.g. bit.ly, tinyurl) to their final destination
+so enrichment checks the page a user would actually land on:
+- Follows HTTP redirects hop by hop (HEAD, falling back to GET) with a hop
+  limit and a per-URL time budget
+- Resolves all links of a message concurrently
+- Caches every hop -> final destination with a TTL, so popular short links
+  are resolved once; the cache is persisted like the enrichment cache
+- Only contacts hosts that resolve to public addresses (no requests into
+  internal networks), and connects to the address that was checked, so a
+  second DNS answer cannot redirect the request (DNS rebinding)
+
+REDIRECT_RESOLVE=off disables network resolution (cached mappings are still
+used).
+"""
+
+import os
+import time
+import socket
+import logging
+import ipaddress
+import threading
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse, urlunparse
+from typing import Dict, List, Any, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.fork_safe import thread_pool
+from utils.persistent_cache import PersistentCache
+
+logger = logging.getLogger("redirect_resolver")
+
+REDIRECT_RESOLVE = os.getenv("REDIRECT_RESOLVE", "on").lower() not in ("0", "off", "false", "no")
+REDIRECT_MAX_HOPS = int(os.getenv("REDIRECT_MAX_HOPS", "5"))
+REDIRECT_TIMEOUT = float(os.getenv("REDIRECT_TIMEOUT", "3"))  # seconds per link, all hops included
+REDIRECT_CACHE_TTL = 6 * 60 * 60
+REDIRECT_ERROR_TTL = 5 * 60  # failed resolutions are retried sooner
+REDIRECT_CACHE_MAX = 50000
+USER_AGENT = "Mozilla/5.0 (compatible; DigitalFortressLinkCheck/1.0)"
+
+_cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()  # hop url -> (resolution, expires)
+_cache_lock = threading.Lock()
+_PERSISTENT_CACHE = PersistentCache("redirects")
+
+_POOL = thread_pool(16, "redirect")
+
+
+def _cache_get(url: str) -> Optional[Dict[str, Any]]:
+    with _cache_lock:
+        entry = _cache.get(url)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            _cache.pop(url, None)
+            return None
+        _cache.move_to_end(url)
+        return entry[0]
+
+
+def _cache_put(url: str, resolution: Dict[str, Any], ttl: float, persist: bool = True) -> None:
+    expires = time.time() + ttl
+    with _cache_lock:
+        _cache[url] = (resolution, expires)
+        _cache.move_to_end(url)
+        while len(_cache) > REDIRECT_CACHE_MAX:
+            _cache.popitem(last=False)
+    if persist:
+        _PERSISTENT_CACHE.put(url, resolution, expires)
+
+
+def warm_cache() -> None:
+    for url, resolution, expires_at in _PERSISTENT_CACHE.load():
+        with _cache_lock:
+            _cache.setdefault(url, (resolution, expires_at))
+
+
+def _public_address(host: Optional[str]) -> Optional[str]:
+    """One address of host if every address it resolves to is public, else None."""
+    if not host:
+        return None
+    try:
+        infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except OSError:
+        return None
+    addresses = [info[4][0].split("%")[0] for info in infos]
+    if not addresses or not all(ipaddress.ip_address(a).is_global for a in addresses):
+        return None
+    return addresses[0]
+
+
+class _PinnedHostAdapter(HTTPAdapter):
+    """Connects to a pre-resolved address while using the hostname for SNI and certificate checks."""
+
+    def __init__(self, hostname: str):
+        self._hostname = hostname
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self._hostname
+        kwargs["assert_hostname"] = self._hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _next_hop(url: str, address: str, timeout: float) -> Optional[str]:
+    """Location of a redirect response for url, or None if url is not a redirect.
+
+    The request goes to `address` (already checked to be public) with the
+    original hostname in the Host header and TLS handshake.
+    """
+    parsed = urlparse(url)
+    ip_host = f"[{address}]" if ":" in address else address
+    netloc = f"{ip_host}:{parsed.port}" if parsed.port else ip_host
+    pinned_url = urlunparse(parsed._replace(netloc=netloc))
+    host_header = f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+    headers = {"User-Agent": USER_AGENT, "Host": host_header}
+    with requests.Session() as session:
+        session.mount("https://", _PinnedHostAdapter(parsed.hostname))
+        response = session.head(pinned_url, allow_redirects=False, timeout=timeout, headers=headers)
+        if response.status_code in (403, 405, 501):
+            # Some servers reject HEAD; GET without reading the body
+            response = session.get(pinned_url, allow_redirects=False, timeout=timeout, headers=headers, stream=True)
+            response.close()
+    location = response.headers.get("Location")
+    if 300 <= response.status_code < 400 and location:
+        return urljoin(url, location)
+    return None
+
+
+def resolve_url(url: str, cached_only: bool = False) -> Dict[str, Any]:
+    """Follow redirects from url: {"final_url", "hops", "status"}; status is
+    resolved, cached, max_hops, timeout, blocked, error or skipped."""
+    cached = _cache_get(url)
+    if cached is not None:
+        return {**cached, "status": "cached"}
+    if cached_only or not REDIRECT_RESOLVE:
+        return {"final_url": url, "hops": 0, "status": "skipped"}
+
+    deadline = time.monotonic() + REDIRECT_TIMEOUT
+    chain = [url]
+    final_url = None
+    extra_hops = 0  # hops beyond the chain, known from a cached later hop
+    status = "resolved"
+    while True:
+        current = chain[-1]
+        if len(chain) > 1:
+            cached = _cache_get(current)
+            if cached is not None:
+                final_url, extra_hops = cached["final_url"], cached["hops"]
+                break
+        if len(chain) > REDIRECT_MAX_HOPS:
+            status = "max_hops"
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            status = "timeout"
+            break
+        parsed = urlparse(current)
+        if parsed.scheme not in ("http", "https"):
+            break
+        address = _public_address(parsed.hostname)
+        if address is None:
+            status = "blocked"
+            break
+        try:
+            location = _next_hop(current, address, remaining)
+        except requests.Timeout:
+            status = "timeout"
+            break
+        except Exception as e:
+            logger.debug(f"Redirect resolution error for {current}: {str(e)}")
+            status = "error"
+            break
+        if location is None or location in chain:
+            break
+        chain.append(location)
+
+    final_url = final_url or chain[-1]
+    ttl = REDIRECT_CACHE_TTL if status in ("resolved", "max_hops") else REDIRECT_ERROR_TTL
+    for i, hop in enumerate(chain):
+        _cache_put(hop, {"final_url": final_url, "hops": len(chain) - 1 - i + extra_hops}, ttl,
+                   persist=ttl == REDIRECT_CACHE_TTL)
+    return {"final_url": final_url, "hops": len(chain) - 1 + extra_hops, "status": status}
+
+
+def resolve_urls(urls: List[str], cached_only: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Resolve several URLs concurrently; results keyed by the original URL."""
+    unique = list(dict.fromkeys(urls))
+    results = {}
+    pending = []
+    for url in unique:
+        cached = _cache_get(url)
+        if cached is not None:
+            results[url] = {**cached, "status": "cached"}
+        elif cached_only or not REDIRECT_RESOLVE or len(unique) == 1:
+            results[url] = resolve_url(url, cached_only)
+        else:
+            pending.append((url, _POOL.get().submit(resolve_url, url)))
+    for url, future in pending:
+        try:
+            results[url] = future.result(timeout=REDIRECT_TIMEOUT + 1)
+        except Exception:
+            results[url] = {"final_url": url, "hops": 0, "status": "timeout"}
+    return results
+
+
+warm_cache()
@@ -0,0 +1,538 @@
+"""
+Local Safe Browsing Database
+----------------------------
+This module implements the Google Safe Browsing v4 Update API so most URL
+checks never leave the process:
+- Periodic `threatListUpdates:fetch` sync of hash-prefix lists (RAW
+  compression), applying full/partial updates and verifying checksums
+- Compact prefix storage: one sorted byte string per prefix length,
+  searched with binary search
+- URL canonicalization and host-suffix / path-prefix expressions hashed
+  locally with SHA-256
+- `fullHashes:find` only on a local prefix hit, with positive and negative
+  full-hash results cached for the durations the API returns
+
+The API base URL can be pointed at a stub server (SAFE_BROWSING_API_BASE)
+for offline testing. The lists and their client states are saved to
+SAFE_BROWSING_SNAPSHOT_PATH after every successful sync: all workers on the
+host load the newest snapshot instead of downloading the lists themselves,
+only one of them (holding a file lock) fetches an update when it is due, and
+a restarted worker resumes with a partial update. Until the first sync succeeds, and after a checksum
+mismatch until the following full update succeeds, `ready` is False and
+callers should fall back to `threatMatches:find`.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import socket
+import hashlib
+import logging
+import threading
+from urllib.parse import unquote_to_bytes
+from typing import Dict, List, Any, Optional, Tuple, Iterable
+
+import requests
+
+from utils.persistent_cache import PERSISTENT_CACHE_PATH
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; every process then syncs on its own
+    fcntl = None
+
+logger = logging.getLogger("safe_browsing_local")
+
+SAFE_BROWSING_API_BASE = os.getenv("SAFE_BROWSING_API_BASE", "https://safebrowsing.googleapis.com/v4")
+SAFE_BROWSING_LISTS = [
+    t.strip() for t in os.getenv("SAFE_BROWSING_LISTS", "MALWARE,SOCIAL_ENGINEERING,UNWANTED_SOFTWARE").split(",")
+    if t.strip()
+]
+PLATFORM_TYPE = "ANY_PLATFORM"
+THREAT_ENTRY_TYPE = "URL"
+CLIENT_INFO = {"clientId": "digital-fortress", "clientVersion": "1.0.0"}
+DEFAULT_UPDATE_INTERVAL = 30 * 60  # used when the API gives no minimumWaitDuration
+ERROR_RETRY_SECONDS = 5 * 60
+REQUEST_TIMEOUT = 10.0  # list downloads can be large
+FULL_HASH_TIMEOUT = 1.5
+SAFE_BROWSING_SNAPSHOT_PATH = os.getenv(
+    "SAFE_BROWSING_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(PERSISTENT_CACHE_PATH), "safe_browsing.json") if PERSISTENT_CACHE_PATH else "",
+)
+SYNC_LOCK_RETRY_SECONDS = 30  # another process is syncing; check its snapshot again after this
+
+
+def _duration(value: Optional[str], default: float = 0.0) -> float:
+    """Parse a protobuf Duration string such as "300.5s"."""
+    try:
+        return float(str(value).rstrip("s"))
+    except (TypeError, ValueError):
+        return default
+
+
+# --- URL canonicalization and expressions ---
+
+def _unescape_fully(s: str) -> str:
+    # Work on latin-1 text so every byte maps to exactly one character
+    for _ in range(10):
+        unescaped = unquote_to_bytes(s.encode("latin-1")).decode("latin-1")
+        if unescaped == s:
+            break
+        s = unescaped
+    return s
+
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _escape(s: str) -> str:
+    return "".join(c if 32 < ord(c) < 127 and c not in "#%" else f"%{ord(c):02X}" for c in s)
+
+
+def _normalize_ip(host: str) -> Optional[str]:
+    if not re.fullmatch(r"[0-9a-fx.]+", host) or not any(ch.isdigit() for ch in host):
+        return None
+    try:
+        return socket.inet_ntoa(socket.inet_aton(host))
+    except OSError:
+        return None
+
+
+def canonicalize(url: str) -> Tuple[str, str, Optional[str]]:
+    """Canonical (host, path, query) per the Safe Browsing URL rules."""
+    url = re.sub(r"[\t\r\n]", "", url.strip())
+    url = url.encode("utf-8").decode("latin-1").split("#", 1)[0]
+    url = _unescape_fully(url)
+    if not re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*://", url):
+        url = f"http://{url}"
+    rest = url.split("://", 1)[1]
+    authority, path_query = re.match(r"([^/?]*)(.*)", rest).groups()
+
+    host = authority.rsplit("@", 1)[-1]
+    if not host.startswith("["):
+        host = host.split(":", 1)[0]
+    host = re.sub(r"\.{2,}", ".", host.strip(".")).translate(_ASCII_LOWER)
+    host = _normalize_ip(host) or host
+
+    path, sep, query = path_query.partition("?")
+    parts = re.sub(r"/+", "/", path or "/").split("/")
+    resolved: List[str] = []
+    for part in parts[1:]:
+        if part == "..":
+            if resolved:
+                resolved.pop()
+        elif part != ".":
+            resolved.append(part)
+    path = "/" + "/".join(resolved)
+    if parts[-1] in ("", ".", "..") and not path.endswith("/"):
+        path += "/"
+    return _escape(host), _escape(path), (_escape(query) if sep else None)
+
+
+def url_expressions(url: str) -> List[str]:
+    """Host-suffix / path-prefix expressions to hash for a URL."""
+    host, path, query = canonicalize(url)
+    if not host:
+        return []
+
+    hosts = [host]
+    if not (_normalize_ip(host) or host.startswith("[")):
+        last5 = host.split(".")[-5:]
+        for i in range(len(last5) - 1):
+            candidate = ".".join(last5[i:])
+            if candidate not in hosts:
+                hosts.append(candidate)
+    hosts = hosts[:5]
+
+    paths = []
+    if query is not None:
+        paths.append(f"{path}?{query}")
+    paths.append(path)
+    prefix = "/"
+    root_paths = [prefix]
+    for component in path.split("/")[1:-1][:3]:
+        prefix += component + "/"
+        root_paths.append(prefix)
+    for p in root_paths:
+        if p not in paths:
+            paths.append(p)
+    return [h + p for h in hosts for p in paths[:6]]
+
+
+def url_hashes(url: str) -> Dict[bytes, str]:
+    """Full SHA-256 hash -> expression for every expression of a URL."""
+    return {hashlib.sha256(e.encode("latin-1", "replace")).digest(): e for e in url_expressions(url)}
+
+
+# --- Local prefix storage ---
+
+class PrefixSet:
+    """Hash prefixes stored as one sorted, concatenated byte string per prefix length."""
+
+    def __init__(self, prefixes: Iterable[bytes] = ()):
+        by_length: Dict[int, List[bytes]] = {}
+        for p in prefixes:
+            by_length.setdefault(len(p), []).append(p)
+        self._blobs = {n: b"".join(sorted(ps)) for n, ps in by_length.items()}
+
+    def __len__(self) -> int:
+        return sum(len(blob) // n for n, blob in self._blobs.items())
+
+    def to_json(self) -> Dict[str, str]:
+        return {str(n): base64.b64encode(blob).decode("ascii") for n, blob in self._blobs.items()}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, str]) -> "PrefixSet":
+        prefix_set = cls()
+        prefix_set._blobs = {int(n): base64.b64decode(blob) for n, blob in data.items()}
+        return prefix_set
+
+    def sorted_prefixes(self) -> List[bytes]:
+        """All prefixes in lexicographic order (the index space used by removals)."""
+        out = []
+        for n, blob in self._blobs.items():
+            out.extend(blob[i:i + n] for i in range(0, len(blob), n))
+        out.sort()
+        return out
+
+    def match(self, full_hash: bytes) -> Optional[bytes]:
+        """The stored prefix of full_hash, if any."""
+        for n, blob in self._blobs.items():
+            target = full_hash[:n]
+            lo, hi = 0, len(blob) // n
+            while lo < hi:
+                mid = (lo + hi) // 2
+                candidate = blob[mid * n:(mid + 1) * n]
+                if candidate < target:
+                    lo = mid + 1
+                elif candidate > target:
+                    hi = mid
+                else:
+                    return target
+        return None
+
+
+class ThreatList:
+    def __init__(self, threat_type: str):
+        self.threat_type = threat_type
+        self.state = ""
+        self.prefixes = PrefixSet()
+
+    def descriptor(self) -> Dict[str, str]:
+        return {"threatType": self.threat_type, "platformType": PLATFORM_TYPE, "threatEntryType": THREAT_ENTRY_TYPE}
+
+    def apply(self, update: Dict[str, Any]) -> bool:
+        """Apply one listUpdateResponse; returns False on checksum mismatch.
+
+        After a mismatch the previous prefixes are kept and the client state is
+        cleared, so the next sync requests a full update.
+        """
+        full = update.get("responseType") == "FULL_UPDATE"
+        current = [] if full else self.prefixes.sorted_prefixes()
+
+        removed = set()
+        for removal in update.get("removals", []):
+            removed.update((removal.get("rawIndices") or {}).get("indices", []))
+        if removed:
+            current = [p for i, p in enumerate(current) if i not in removed]
+
+        for addition in update.get("additions", []):
+            raw = addition.get("rawHashes") or {}
+            size = int(raw.get("prefixSize", 4))
+            data = base64.b64decode(raw.get("rawHashes", ""))
+            current.extend(data[i:i + size] for i in range(0, len(data), size))
+        current.sort()
+
+        expected = (update.get("checksum") or {}).get("sha256")
+        if expected and hashlib.sha256(b"".join(current)).digest() != base64.b64decode(expected):
+            logger.error(f"Safe Browsing checksum mismatch for {self.threat_type}; requesting full update")
+            self.state = ""
+            return False
+
+        self.prefixes = PrefixSet(current)
+        self.state = update.get("newClientState", "")
+        return True
+
+
+class LocalSafeBrowsing:
+    """Local threat-list database with full-hash caching."""
+
+    def __init__(self, api_key: Optional[str] = None, api_base: str = SAFE_BROWSING_API_BASE,
+                 threat_types: Optional[List[str]] = None, snapshot_path: str = SAFE_BROWSING_SNAPSHOT_PATH):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.snapshot_path = snapshot_path
+        self._snapshot_mtime = 0.0
+        self.lists = {t: ThreatList(t) for t in (threat_types or SAFE_BROWSING_LISTS)}
+        self.ready = False
+        self.next_update = 0.0
+        self.next_full_hash = 0.0  # honours minimumWaitDuration from fullHashes:find
+        self._lock = threading.RLock()
+        self._updating = False
+        self._positive: Dict[bytes, Tuple[str, float]] = {}  # full hash -> (threat type, expires)
+        self._negative: Dict[bytes, float] = {}  # prefix -> expires
+        self.load_snapshot()
+
+    def _url(self, method: str) -> str:
+        return f"{self.api_base}/{method}?key={self.api_key}"
+
+    # --- list sync ---
+    def update(self) -> bool:
+        """Fetch and apply list updates once. Returns True on success."""
+        with self._lock:
+            request_lists = [
+                {**tl.descriptor(), "state": tl.state, "constraints": {"supportedCompressions": ["RAW"]}}
+                for tl in self.lists.values()
+            ]
+        try:
+            response = requests.post(
+                self._url("threatListUpdates:fetch"),
+                json={"client": CLIENT_INFO, "listUpdateRequests": request_lists},
+                timeout=REQUEST_TIMEOUT,
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"API returned status {response.status_code}")
+            body = response.json()
+            with self._lock:
+                ok = True
+                for update in body.get("listUpdateResponses", []):
+                    tl = self.lists.get(update.get("threatType"))
+                    if tl is not None:
+                        ok = tl.apply(update) and ok
+                wait = _duration(body.get("minimumWaitDuration"), DEFAULT_UPDATE_INTERVAL)
+                self.next_update = time.time() + (wait if ok else min(wait, 60))
+                # Not ready while any list is inconsistent; lookups fall back to threatMatches:find
+                self.ready = ok
+                self._negative.clear()  # list contents changed
+                self._prune_positive()
+                if ok:
+                    self._save_snapshot()
+            logger.info(f"Safe Browsing lists updated: {self.stats()['prefixes']}")
+            return ok
+        except Exception as e:
+            logger.error(f"Safe Browsing list update error: {str(e)}")
+            self.next_update = time.time() + ERROR_RETRY_SECONDS
+            return False
+
+    def _prune_positive(self) -> None:
+        """Drop expired full-hash matches; reads skip them, but they would otherwise stay forever."""
+        now = time.time()
+        for h in [h for h, (_, expires) in self._positive.items() if expires <= now]:
+            del self._positive[h]
+
+    # --- snapshot shared by the processes on this host ---
+    def _save_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        snapshot = {
+            "api_base": self.api_base,
+            "next_update": self.next_update,
+            "lists": {t: {"state": tl.state, "prefixes": tl.prefixes.to_json()} for t, tl in self.lists.items()},
+        }
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.snapshot_path)
+            self._snapshot_mtime = os.path.getmtime(self.snapshot_path)
+        except Exception as e:
+            logger.error(f"Safe Browsing snapshot save error: {str(e)}")
+
+    def load_snapshot(self) -> bool:
+        """Adopt the saved lists if another process wrote a newer snapshot. Returns True if loaded."""
+        if not self.snapshot_path:
+            return False
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+            if mtime <= self._snapshot_mtime:
+                return False
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("api_base") != self.api_base:
+                return False
+            saved = snapshot.get("lists", {})
+            if set(saved) != set(self.lists):
+                return False  # configured lists changed; sync them from scratch
+            with self._lock:
+                for t, tl in self.lists.items():
+                    tl.state = saved[t].get("state", "")
+                    tl.prefixes = PrefixSet.from_json(saved[t].get("prefixes", {}))
+                self.next_update = float(snapshot.get("next_update", 0))
+                self.ready = all(tl.state for tl in self.lists.values())
+                self._negative.clear()
+                self._snapshot_mtime = mtime
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Safe Browsing snapshot load error: {str(e)}")
+            return False
+
+    def _sync_shared(self) -> None:
+        """Sync unless another process is already doing so; its snapshot is picked up later."""
+        lock_file = None
+        try:
+            if fcntl is not None and self.snapshot_path:
+                os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+                lock_file = open(f"{self.snapshot_path}.lock", "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.next_update = time.time() + SYNC_LOCK_RETRY_SECONDS
+                    return
+                # The previous lock holder may have just written a fresh snapshot
+                if self.load_snapshot() and time.time() < self.next_update:
+                    return
+            self.update()
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def maybe_update(self, background: bool = True) -> None:
+        """Start a sync when one is due (in a background thread by default)."""
+        self.load_snapshot()
+        with self._lock:
+            if self._updating or time.time() < self.next_update:
+                return
+            self._updating = True
+
+        def run():
+            try:
+                self._sync_shared()
+            except Exception as e:
+                logger.error(f"Safe Browsing sync error: {str(e)}")
+                self.next_update = time.time() + ERROR_RETRY_SECONDS
+            finally:
+                self._updating = False
+
+        if background:
+            threading.Thread(target=run, name="safe-browsing-update", daemon=True).start()
+        else:
+            run()
+
+    # --- lookups ---
+    def _prefix_hits(self, hashes: Iterable[bytes]) -> Dict[bytes, bytes]:
+        hits = {}
+        with self._lock:
+            for h in hashes:
+                for tl in self.lists.values():
+                    prefix = tl.prefixes.match(h)
+                    if prefix is not None:
+                        hits[h] = prefix
+                        break
+        return hits
+
+    def _find_full_hashes(self, prefixes: List[bytes]) -> Dict[str, Any]:
+        with self._lock:
+            states = [tl.state for tl in self.lists.values() if tl.state]
+        payload = {
+            "client": CLIENT_INFO,
+            "clientStates": states,
+            "threatInfo": {
+                "threatTypes": list(self.lists),
+                "platformTypes": [PLATFORM_TYPE],
+                "threatEntryTypes": [THREAT_ENTRY_TYPE],
+                "threatEntries": [{"hash": base64.b64encode(p).decode("ascii")} for p in prefixes],
+            },
+        }
+        response = requests.post(self._url("fullHashes:find"), json=payload, timeout=FULL_HASH_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"API returned status {response.status_code}")
+        return response.json()
+
+    def lookup_many(self, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Check several URLs, making at most one fullHashes:find call for all prefix hits."""
+        now = time.time()
+        url_hash_map = {url: url_hashes(url) for url in urls}
+        hits = self._prefix_hits({h for hs in url_hash_map.values() for h in hs})
+
+        # Resolve from the full-hash caches where possible
+        to_fetch = set()
+        with self._lock:
+            for h, prefix in hits.items():
+                positive = self._positive.get(h)
+                if positive and positive[1] > now:
+                    continue
+                if self._negative.get(prefix, 0) > now:
+                    continue
+                to_fetch.add(prefix)
+
+        error = None
+        if to_fetch and now < self.next_full_hash:
+            error = "fullHashes:find back-off in effect"
+        elif to_fetch:
+            try:
+                body = self._find_full_hashes(sorted(to_fetch))
+                with self._lock:
+                    for match in body.get("matches", []):
+                        full = base64.b64decode((match.get("threat") or {}).get("hash", ""))
+                        ttl = _duration(match.get("cacheDuration"), 300)
+                        self._positive[full] = (match.get("threatType", "UNKNOWN"), now + ttl)
+                    negative_ttl = _duration(body.get("negativeCacheDuration"), 300)
+                    for prefix in to_fetch:
+                        self._negative[prefix] = now + negative_ttl
+                    self.next_full_hash = now + _duration(body.get("minimumWaitDuration"), 0)
+            except Exception as e:
+                logger.error(f"Safe Browsing fullHashes:find error: {str(e)}")
+                error = str(e)
+
+        results = {}
+        with self._lock:
+            for url, hashes in url_hash_map.items():
+                threat = None
+                unresolved = False
+                for h in hashes:
+                    if h not in hits:
+                        continue
+                    positive = self._positive.get(h)
+                    if positive and positive[1] > now:
+                        threat = positive[0]
+                        break
+                    if self._negative.get(hits[h], 0) <= now:
+                        unresolved = True
+                if threat:
+                    results[url] = {"status": "unsafe", "threat_type": threat, "score": 100, "source": "local"}
+                elif unresolved and error:
+                    results[url] = {"status": "error", "reason": error}
+                else:
+                    results[url] = {"status": "safe", "score": 0, "source": "local"}
+        return results
+
+    def lookup(self, url: str) -> Dict[str, Any]:
+        return self.lookup_many([url])[url]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "prefixes": {t: len(tl.prefixes) for t, tl in self.lists.items()},
+                "cached_full_hashes": len(self._positive),
+                "next_update_in": max(0, round(self.next_update - time.time())),
+            }
+
+
+_db: Optional[LocalSafeBrowsing] = None
+_db_lock = threading.Lock()
+
+
+def get_local_db(api_key: str, background: bool = True) -> LocalSafeBrowsing:
+    """Process-wide database; schedules a sync whenever one is due.
+
+    Pass background=False to sync in the calling thread, e.g. in a preforking
+    server's master, where a thread would not survive the fork.
+    """
+    global _db
+    if _db is None or _db.api_key != api_key:
+        with _db_lock:
+            if _db is None or _db.api_key != api_key:
+                _db = LocalSafeBrowsing(api_key)
+    _db.maybe_update(background=background)
+    return _db
+
+
+def local_db_stats() -> Optional[Dict[str, Any]]:
+    """Stats of the process-wide database, or None before first use."""
+    return _db.stats() if _db is not None else None
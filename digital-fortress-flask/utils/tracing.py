@@ -0,0 +1,145 @@
+"""
+Request Tracing and Profiling
+-----------------------------
+This module records where request time goes, with near-zero cost when off:
+- `span(name)` context manager timing a stage of the current request
+  (no-op outside a traced request, so utils can be instrumented freely)
+- Per-request stage breakdown in a `Server-Timing` response header, and in
+  a `timing` field of JSON responses when `X-Debug-Timing: 1` is sent
+- Slow-request log line with the breakdown (SLOW_REQUEST_MS)
+- cProfile for sampled requests (PROFILE_SAMPLE_RATE) or requests carrying
+  `X-Profile: <PROFILE_TOKEN>`, dumped as .prof files to PROFILE_DIR
+"""
+
+import os
+import re
+import time
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger("tracing")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "profiles"))
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("trace", default=None)
+_profile_lock = threading.Lock()  # cProfile supports one active profiler at a time
+_TOKEN_UNSAFE = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+class Trace:
+    """Stage timings (milliseconds) for one request, aggregated by span name."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def add(self, name: str, ms: float) -> None:
+        stage = self.stages.setdefault(name, {"ms": 0.0, "count": 0})
+        stage["ms"] += ms
+        stage["count"] += 1
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.total_ms(), 2),
+            "stages": {k: {"ms": round(v["ms"], 2), "count": v["count"]} for k, v in self.stages.items()},
+        }
+
+    def server_timing(self) -> str:
+        parts = [
+            f"{_TOKEN_UNSAFE.sub('_', name)};dur={v['ms']:.2f}" + (f';desc="x{v["count"]}"' if v["count"] > 1 else "")
+            for name, v in self.stages.items()
+        ]
+        parts.append(f"total;dur={self.total_ms():.2f}")
+        return ", ".join(parts)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current request; does nothing when no trace is active."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, (time.perf_counter() - started) * 1000)
+
+
+def init_tracing(app) -> None:
+    """Install request hooks and a traced JSON provider on a Flask app."""
+    import cProfile
+    from flask import request, g, json as flask_json
+    from flask.json.provider import DefaultJSONProvider
+
+    class TracedJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            with span("json"):
+                return super().dumps(obj, **kwargs)
+
+    app.json = TracedJSONProvider(app)
+
+    @app.before_request
+    def _start_trace():
+        g._trace_token = _current.set(Trace())
+        g._profiler = None
+        wants_profile = bool(PROFILE_TOKEN) and request.headers.get("X-Profile") == PROFILE_TOKEN
+        if (wants_profile or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE)) \
+                and _profile_lock.acquire(blocking=False):
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+    @app.after_request
+    def _finish_trace(response):
+        trace = _current.get()
+        if trace is None:
+            return response
+
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                name = f"{int(time.time() * 1000)}-{_TOKEN_UNSAFE.sub('_', request.endpoint or 'unknown')}.prof"
+                profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+                response.headers["X-Profile-File"] = name
+            except Exception as e:
+                logger.error(f"Could not write profile: {str(e)}")
+
+        if request.headers.get("X-Debug-Timing") == "1" and response.is_json:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                body["timing"] = trace.summary()
+                response.set_data(flask_json.dumps(body))
+
+        response.headers["Server-Timing"] = trace.server_timing()
+        total = trace.total_ms()
+        if total >= SLOW_REQUEST_MS:
+            logger.warning(f"Slow request {request.method} {request.path} {total:.0f}ms stages={trace.summary()['stages']}")
+        return response
+
+    @app.teardown_request
+    def _end_trace(exc=None):
+        token = g.pop("_trace_token", None)
+        if token is not None:
+            _current.reset(token)
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:  # after_request was skipped by an unhandled error
+            profiler.disable()
+            _profile_lock.release()
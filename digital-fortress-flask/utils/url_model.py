@@ -0,0 +1,244 @@
+"""
+Lexical URL Classifier
+----------------------
+This module scores URLs from their text alone, without any network calls:
+- Lexical feature extraction (length, entropy, digit ratio, tokens, TLD,
+  subdomain depth, keyword hits) into NumPy feature matrices for batches
+- A logistic regression model loaded once from a JSON model file
+- Vectorized batch inference plus per-URL explanations
+- A small training helper to refit the model from labelled URLs
+
+NumPy is optional: when it is missing, or the model file cannot be loaded,
+`model_available()` is False and callers fall back to heuristic scoring.
+"""
+
+import os
+import json
+import logging
+import threading
+from urllib.parse import urlsplit
+from typing import Dict, List, Any, Optional
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger("url_model")
+
+MODEL_PATH = os.getenv(
+    "URL_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "url_lexical_model.json"),
+)
+MAX_URL_CHARS = 512
+
+URL_KEYWORDS = [
+    "login", "signin", "verify", "update", "password", "bank", "account", "secure",
+    "gift", "lottery", "confirm", "unlock", "suspend", "win", "otp", "credential", "wallet", "kyc",
+]
+RISKY_TLDS = {
+    "zip", "mov", "xyz", "top", "club", "online", "site", "icu", "buzz", "gq", "ml", "cf", "tk", "ga",
+    "work", "click", "link", "rest", "cam", "live", "fit", "loan", "kim", "country",
+}
+
+FEATURE_NAMES = [
+    "url_length", "host_length", "path_length", "entropy", "digit_ratio", "special_ratio",
+    "token_count", "subdomain_depth", "is_http", "ip_host", "keyword_hits", "risky_tld",
+    "at_sign", "host_hyphens",
+]
+
+# Human-readable reason for a feature that pushes a URL towards "malicious"
+FEATURE_REASONS = {
+    "url_length": "Unusually long URL",
+    "host_length": "Unusually long hostname",
+    "path_length": "Unusually long path",
+    "entropy": "Random-looking characters in URL",
+    "digit_ratio": "High proportion of digits in URL",
+    "special_ratio": "Many special characters in URL",
+    "token_count": "URL split into many tokens",
+    "subdomain_depth": "Too many subdomains (possible obfuscation)",
+    "is_http": "Site uses insecure HTTP (no HTTPS)",
+    "ip_host": "Raw IP address used instead of a domain",
+    "keyword_hits": "Suspicious keywords in URL",
+    "risky_tld": "Top-level domain frequently used for abuse",
+    "at_sign": "'@' in URL (can hide the real destination)",
+    "host_hyphens": "Hyphenated hostname (common in lookalike domains)",
+}
+
+_SEPARATORS = [ord(c) for c in "./-_=?&%"]
+
+_model: Optional[Dict[str, Any]] = None
+_load_failed = False  # set when the model file could not be loaded; cleared by reload_model()
+_model_lock = threading.Lock()
+
+
+def _host_features(url: str) -> List[float]:
+    """Features that need the parsed URL; computed per URL."""
+    try:
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        host = (parts.hostname or "").lower()
+        scheme = parts.scheme.lower()
+        path = parts.path or ""
+    except ValueError:
+        host, scheme, path = "", "", ""
+    labels = host.split(".") if host else []
+    ip_host = (bool(labels) and all(label.isdigit() for label in labels)) or ":" in host
+    tld = labels[-1] if labels else ""
+    lowered = url.lower()
+    return [
+        float(len(host)),
+        float(len(path)),
+        float(max(0, len(labels) - 2)),
+        1.0 if scheme == "http" else 0.0,
+        1.0 if ip_host else 0.0,
+        float(sum(1 for kw in URL_KEYWORDS if kw in lowered)),
+        1.0 if tld in RISKY_TLDS else 0.0,
+        float(host.count("-")),
+    ]
+
+
+def extract_features(urls: List[str]) -> "np.ndarray":
+    """Build an (n, len(FEATURE_NAMES)) float matrix for a batch of URLs.
+
+    Character statistics are computed for the whole batch at once from a
+    single byte histogram; only hostname parsing runs per URL.
+    """
+    n = len(urls)
+    encoded = [(u or "").encode("utf-8", "ignore")[:MAX_URL_CHARS] for u in urls]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=n)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+    counts = np.bincount(rows * 256 + data, minlength=n * 256).reshape(n, 256).astype(np.float64)
+
+    safe_len = np.maximum(lengths, 1).astype(np.float64)
+    digits = counts[:, 48:58].sum(axis=1)
+    alnum = digits + counts[:, 65:91].sum(axis=1) + counts[:, 97:123].sum(axis=1)
+    probs = counts / safe_len[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(probs > 0, probs * np.log2(probs), 0.0).sum(axis=1)
+
+    per_url = np.array([_host_features(u or "") for u in urls], dtype=np.float64).reshape(n, 8)
+
+    features = np.empty((n, len(FEATURE_NAMES)), dtype=np.float64)
+    features[:, 0] = lengths
+    features[:, 1] = per_url[:, 0]
+    features[:, 2] = per_url[:, 1]
+    features[:, 3] = entropy
+    features[:, 4] = digits / safe_len
+    features[:, 5] = (lengths - alnum) / safe_len
+    features[:, 6] = counts[:, _SEPARATORS].sum(axis=1) + 1
+    features[:, 7] = per_url[:, 2]
+    features[:, 8] = per_url[:, 3]
+    features[:, 9] = per_url[:, 4]
+    features[:, 10] = per_url[:, 5]
+    features[:, 11] = per_url[:, 6]
+    features[:, 12] = counts[:, ord("@")] > 0
+    features[:, 13] = per_url[:, 7]
+    return features
+
+
+def load_model(path: str = MODEL_PATH) -> Optional[Dict[str, Any]]:
+    """Load the model file once; later calls return the cached model.
+
+    A failed load is remembered too, so the file is not re-read on every
+    request; `reload_model()` tries again.
+    """
+    global _model, _load_failed
+    if _model is not None or _load_failed or np is None:
+        return _model
+    with _model_lock:
+        if _model is None and not _load_failed:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                if raw.get("features") != FEATURE_NAMES:
+                    raise ValueError("model features do not match FEATURE_NAMES")
+                _model = {
+                    "version": raw.get("version", "unknown"),
+                    "mean": np.asarray(raw["mean"], dtype=np.float64),
+                    "std": np.asarray(raw["std"], dtype=np.float64),
+                    "weights": np.asarray(raw["weights"], dtype=np.float64),
+                    "bias": float(raw["bias"]),
+                }
+            except Exception as e:
+                _load_failed = True
+                logger.error(f"Could not load URL model from {path}: {str(e)}")
+    return _model
+
+
+def reload_model(path: str = MODEL_PATH) -> Optional[Dict[str, Any]]:
+    """Drop the cached model (or remembered failure) and load the file again."""
+    global _model, _load_failed
+    with _model_lock:
+        _model = None
+        _load_failed = False
+    return load_model(path)
+
+
+def model_available() -> bool:
+    return load_model() is not None
+
+
+def predict_proba(urls: List[str]) -> "np.ndarray":
+    """Probability that each URL is malicious, as a 1-D array."""
+    model = load_model()
+    if model is None:
+        raise RuntimeError("URL model is not available")
+    z = ((extract_features(urls) - model["mean"]) / model["std"]) @ model["weights"] + model["bias"]
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def score_urls(urls: List[str], max_reasons: int = 3) -> List[Dict[str, Any]]:
+    """Score a batch of URLs; returns risk score (0-100) and top reasons per URL."""
+    model = load_model()
+    if model is None:
+        raise RuntimeError("URL model is not available")
+    if not urls:
+        return []
+    contributions = ((extract_features(urls) - model["mean"]) / model["std"]) * model["weights"]
+    probs = 1.0 / (1.0 + np.exp(-(contributions.sum(axis=1) + model["bias"])))
+    top = np.argsort(-contributions, axis=1)[:, :max_reasons]
+
+    results = []
+    for i in range(len(urls)):
+        reasons = [FEATURE_REASONS[FEATURE_NAMES[j]] for j in top[i] if contributions[i, j] > 0.5]
+        results.append({
+            "risk_score": int(round(float(probs[i]) * 100)),
+            "reasons": reasons,
+            "model_version": model["version"],
+        })
+    return results
+
+
+def train_model(urls: List[str], labels: List[int], epochs: int = 500, lr: float = 0.1,
+                l2: float = 1e-3, version: str = "lexical-lr") -> Dict[str, Any]:
+    """Fit logistic regression on labelled URLs (1 = malicious) with batch gradient descent.
+
+    Returns a JSON-serialisable model dict suitable for `save_model`.
+    """
+    X = extract_features(urls)
+    y = np.asarray(labels, dtype=np.float64)
+    mean = X.mean(axis=0)
+    std = X.std(axis=0)
+    std[std == 0] = 1.0
+    Xs = (X - mean) / std
+    w = np.zeros(X.shape[1])
+    b = 0.0
+    for _ in range(epochs):
+        p = 1.0 / (1.0 + np.exp(-(Xs @ w + b)))
+        err = p - y
+        w -= lr * (Xs.T @ err / len(y) + l2 * w)
+        b -= lr * err.mean()
+    return {
+        "version": version,
+        "features": FEATURE_NAMES,
+        "mean": mean.round(6).tolist(),
+        "std": std.round(6).tolist(),
+        "weights": w.round(6).tolist(),
+        "bias": round(float(b), 6),
+    }
+
+
+def save_model(model: Dict[str, Any], path: str = MODEL_PATH) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(model, f, indent=2)
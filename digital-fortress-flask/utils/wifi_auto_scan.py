@@ -1,12 +1,20 @@
 import os
+import ssl
 import time
-from typing import Dict, Any
+import socket
+import hashlib
+import ipaddress
+import threading
+from typing import Dict, Any, List
 import json
 import requests
+from utils.fork_safe import thread_pool
+from utils.persistent_cache import PersistentCache
 
 # Cache: prefer Redis if URL is provided, else in-memory
 _CACHE: Dict[str, Any] = {}
 _CACHE_TTL_SECONDS = 60 * 30  # 30 minutes
+_PERSISTENT_CACHE = PersistentCache("wifi_scan")  # on-disk snapshot used to warm _CACHE
 
 _redis = None
 _redis_url = os.getenv("WIFI_REDIS_URL") or os.getenv("REDIS_URL")
@@ -41,11 +49,54 @@ def _cache_set(key: str, value: Any):
             return
     except Exception:
         pass
-    _CACHE[key] = {"ts": time.time(), "value": value}
+    now = time.time()
+    _CACHE[key] = {"ts": now, "value": value}
+    _PERSISTENT_CACHE.put(key, value, now + _CACHE_TTL_SECONDS)
+
+
+def _warm_cache() -> None:
+    for key, value, expires_at in _PERSISTENT_CACHE.load():
+        _CACHE.setdefault(key, {"ts": expires_at - _CACHE_TTL_SECONDS, "value": value})
+
+
+_warm_cache()
 
 
 DEFAULT_TIMEOUT = float(os.getenv("WIFI_SCAN_TIMEOUT", "1.8"))
 
+# Local network probes: TLS handshakes ("host" or "host:port") and resolver comparison
+TLS_PROBE_HOSTS = [h.strip() for h in os.getenv("WIFI_TLS_PROBE_HOSTS", "www.google.com,www.cloudflare.com,github.com").split(",") if h.strip()]
+TLS_CA_FILE = os.getenv("WIFI_TLS_CA_FILE")  # extra trust anchors, e.g. for local stand-in servers
+# Pinned leaf certificate SHA-256 fingerprints: "host=fp1,fp2;host2=fp3"
+TLS_PINS = {
+    host.strip(): {fp.strip().lower().replace(":", "") for fp in fps.split(",") if fp.strip()}
+    for host, _, fps in (entry.partition("=") for entry in os.getenv("WIFI_TLS_PINS", "").split(";") if "=" in entry)
+}
+DNS_PROBE_NAMES = [n.strip() for n in os.getenv("WIFI_DNS_PROBE_NAMES", "example.com,www.wikipedia.org").split(",") if n.strip()]
+DOH_URL = os.getenv("WIFI_DOH_URL", "https://dns.google/resolve")
+_TLS_BASELINE_TTL = 30 * 24 * 3600
+_TLS_BASELINE_MAX = 8  # fingerprints remembered per host (CDNs rotate between several)
+_TLS_BASELINE: Dict[str, List[str]] = {}
+_TLS_BASELINE_CACHE = PersistentCache("wifi_tls_baseline")
+_tls_lock = threading.Lock()
+
+for _host, _fps, _ in _TLS_BASELINE_CACHE.load():
+    _TLS_BASELINE.setdefault(_host, _fps)
+
+_PROBE_POOL = thread_pool(32, "wifi-probe")
+
+# Most recent scan result, served when new scans are shed under load
+_LAST_RESULT: Dict[str, Any] = {}
+
+
+def last_auto_wifi_scan():
+    """Most recent scan result in this process (or a warmed cache entry), without network calls."""
+    if _LAST_RESULT:
+        return dict(_LAST_RESULT)
+    now = time.time()
+    fresh = [e for e in _CACHE.values() if now - e["ts"] <= _CACHE_TTL_SECONDS]
+    return dict(max(fresh, key=lambda e: e["ts"])["value"]) if fresh else None
+
 
 def _get_ipapi() -> Dict[str, Any]:
     try:
@@ -93,27 +144,80 @@ def _get_ipinfo() -> Dict[str, Any]:
         return {"error": str(e)}
 
 
-def _dns_google_test() -> Dict[str, Any]:
+def _system_resolve(name: str) -> Dict[str, Any]:
+    started = time.perf_counter()
     try:
-        # Resolve example domain via Google DNS HTTPS resolver
-        r = requests.get(
-            "https://dns.google/resolve",
-            params={"name": "example.com", "type": "A"},
-            timeout=DEFAULT_TIMEOUT,
-        )
+        infos = socket.getaddrinfo(name, None, socket.AF_INET, socket.SOCK_STREAM)
+        addrs = sorted({info[4][0] for info in infos})
+        return {"ok": bool(addrs), "addresses": addrs, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        return {"ok": False, "error": str(e), "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def _doh_resolve(name: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        r = requests.get(DOH_URL, params={"name": name, "type": "A"}, timeout=DEFAULT_TIMEOUT)
+        ms = round((time.perf_counter() - started) * 1000, 1)
         if r.ok:
             j = r.json()
-            status = j.get("Status", 0)
-            answers = j.get("Answer", [])
-            return {
-                "resolver": "dns.google",
-                "ok": status == 0 and len(answers) > 0,
-                "status": status,
-                "answer_count": len(answers),
-            }
-        return {"resolver": "dns.google", "ok": False, "status": r.status_code}
+            addrs = sorted({a["data"] for a in j.get("Answer", []) if a.get("type") == 1})
+            return {"ok": j.get("Status", 0) == 0 and bool(addrs), "status": j.get("Status", 0), "addresses": addrs, "ms": ms}
+        return {"ok": False, "status": r.status_code, "ms": ms}
     except Exception as e:
-        return {"resolver": "dns.google", "ok": False, "error": str(e)}
+        return {"ok": False, "error": str(e), "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def _is_public(addr: str) -> bool:
+    try:
+        return ipaddress.ip_address(addr).is_global
+    except ValueError:
+        return False
+
+
+def _dns_probe() -> Dict[str, Any]:
+    """Resolve probe names via the system resolver and DoH concurrently and compare."""
+    started = time.perf_counter()
+    pool = _PROBE_POOL.get()
+    futures = [(name, pool.submit(_system_resolve, name), pool.submit(_doh_resolve, name)) for name in DNS_PROBE_NAMES]
+    names = []
+    for name, sys_future, doh_future in futures:
+        try:
+            system = sys_future.result(timeout=DEFAULT_TIMEOUT + 0.5)
+        except Exception:
+            system = {"ok": False, "error": "timeout"}
+        try:
+            doh = doh_future.result(timeout=DEFAULT_TIMEOUT + 0.5)
+        except Exception:
+            doh = {"ok": False, "error": "timeout"}
+
+        # CDNs legitimately answer differently per resolver, so only treat as
+        # suspicious a local answer pointing at non-public space, or a local
+        # failure where DoH succeeds
+        sys_addrs = system.get("addresses", [])
+        if system.get("ok") and doh.get("ok"):
+            overlap = bool(set(sys_addrs) & set(doh.get("addresses", [])))
+            suspicious = not overlap and not all(_is_public(a) for a in sys_addrs)
+            comparison = "match" if overlap else ("suspicious" if suspicious else "differs")
+        elif doh.get("ok"):
+            comparison = "suspicious"
+        else:
+            comparison = "inconclusive"
+        names.append({"name": name, "system": system, "doh": doh, "comparison": comparison})
+
+    result = {
+        "resolver": "system+doh",
+        "ok": any(n["system"].get("ok") for n in names),
+        "mismatch": any(n["comparison"] == "suspicious" for n in names),
+        "inconclusive": bool(names) and all(n["comparison"] == "inconclusive" for n in names),
+        "names": names,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if not result["ok"]:
+        # Why the system resolver failed, for display; names[] has the per-name detail
+        failure = next((n["system"] for n in names if not n["system"].get("ok")), {})
+        result["error"] = failure.get("error") or ("no addresses returned" if failure else "no probe names configured")
+    return result
 
 
 def _captive_portal_probe() -> Dict[str, Any]:
@@ -157,22 +261,91 @@ def _abuseipdb_check(ip: str) -> Dict[str, Any]:
         return {"error": str(e)}
 
 
-def _ssl_labs_probe(host: str = "google.com") -> Dict[str, Any]:
-    # Optional: check a well-known host's TLS chain from current network
+def _tls_context(verify: bool) -> ssl.SSLContext:
+    ctx = ssl.create_default_context(cafile=TLS_CA_FILE) if verify else ssl.create_default_context()
+    if TLS_CA_FILE and verify:
+        ctx.load_default_certs()
+    if not verify:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+def _handshake(host: str, port: int, verify: bool) -> Dict[str, Any]:
+    started = time.perf_counter()
+    with socket.create_connection((host, port), timeout=DEFAULT_TIMEOUT) as sock:
+        connected = time.perf_counter()
+        with _tls_context(verify).wrap_socket(sock, server_hostname=host) as tls:
+            done = time.perf_counter()
+            leaf = tls.getpeercert(binary_form=True) or b""
+            chain = []
+            get_chain = getattr(tls, "get_unverified_chain", None)  # Python 3.13+
+            if get_chain is not None:
+                chain = [hashlib.sha256(c if isinstance(c, bytes) else c.public_bytes()).hexdigest()
+                         for c in (get_chain() or [])]
+            return {
+                "fingerprint": hashlib.sha256(leaf).hexdigest(),
+                "chain": chain,
+                "tls_version": tls.version(),
+                "connect_ms": round((connected - started) * 1000, 1),
+                "handshake_ms": round((done - connected) * 1000, 1),
+            }
+
+
+def _tls_probe(target: str) -> Dict[str, Any]:
+    """Handshake with a well-known host and compare its certificate to the pinned/seen baseline."""
+    host, _, port = target.partition(":")
+    port = int(port or 443)
     try:
-        r = requests.get(
-            "https://api.ssllabs.com/api/v3/analyze",
-            params={"host": host, "fromCache": "on", "maxAge": 24},
-            timeout=DEFAULT_TIMEOUT,
-        )
-        if r.ok:
-            j = r.json()
-            endpoints = j.get("endpoints", [])
-            grade = endpoints[0].get("grade") if endpoints else None
-            return {"host": host, "grade": grade or "unknown"}
-        return {"host": host, "error": f"ssllabs status {r.status_code}"}
+        try:
+            info = _handshake(host, port, verify=True)
+            verified, verify_error = True, None
+        except ssl.SSLCertVerificationError as e:
+            # Fetch the presented certificate anyway so it can be reported
+            info = _handshake(host, port, verify=False)
+            verified, verify_error = False, e.verify_message or str(e)
     except Exception as e:
-        return {"host": host, "error": str(e)}
+        return {"host": target, "status": "error", "error": str(e)}
+
+    fp = info["fingerprint"]
+    pins = TLS_PINS.get(target) or TLS_PINS.get(host)
+    with _tls_lock:
+        seen = _TLS_BASELINE.get(target, [])
+        if not verified or (pins and fp not in pins):
+            status = "intercepted"
+        elif pins or not seen or fp in seen:
+            status = "ok"
+        else:
+            status = "changed"  # valid chain, new certificate: rotation or a trusted middlebox
+        # Only certificates that chain to a trusted root join the baseline
+        if verified and fp not in seen and status != "intercepted":
+            seen = ([fp] + seen)[:_TLS_BASELINE_MAX]
+            _TLS_BASELINE[target] = seen
+            _TLS_BASELINE_CACHE.put(target, seen, time.time() + _TLS_BASELINE_TTL)
+
+    result = {"host": target, "status": status, "verified": verified, **info}
+    if verify_error:
+        result["verify_error"] = verify_error
+    return result
+
+
+def _start_tls_probes() -> Dict[str, Any]:
+    pool = _PROBE_POOL.get()
+    return {"started": time.perf_counter(), "futures": [(t, pool.submit(_tls_probe, t)) for t in TLS_PROBE_HOSTS]}
+
+
+def _collect_tls_probes(pending: Dict[str, Any]) -> Dict[str, Any]:
+    hosts = []
+    for target, future in pending["futures"]:
+        try:
+            hosts.append(future.result(timeout=2 * DEFAULT_TIMEOUT + 0.5))
+        except Exception:
+            hosts.append({"host": target, "status": "error", "error": "timeout"})
+    return {
+        "hosts": hosts,
+        "interception_suspected": any(h["status"] == "intercepted" for h in hosts),
+        "ms": round((time.perf_counter() - pending["started"]) * 1000, 1),
+    }
 
 
 def _score(telemetry: Dict[str, Any]) -> Dict[str, Any]:
@@ -189,6 +362,15 @@ def _score(telemetry: Dict[str, Any]) -> Dict[str, Any]:
     if not dns.get("ok", False):
         score += 20
         notes.append("DNS resolver issues")
+    elif dns.get("mismatch"):
+        score += 25
+        notes.append("DNS answers differ from DoH (possible DNS hijacking)")
+
+    # Certificates that fail validation or pins suggest TLS interception
+    tls = telemetry.get("tls", {})
+    if tls.get("interception_suspected"):
+        score += 40
+        notes.append("TLS interception suspected")
 
     # AbuseIPDB score contributes directly (capped)
     abuse = telemetry.get("abuseipdb", {})
@@ -224,15 +406,21 @@ def auto_wifi_scan() -> Dict[str, Any]:
     public_ip = ipinfo.get("ip") or ipapi.get("ip")
 
     # Cache key per public IP
-    cache_key = f"auto_wifi_scan_v1:{public_ip or 'noip'}"
+    cache_key = f"auto_wifi_scan_v2:{public_ip or 'noip'}"
     cached = _cache_get(cache_key)
     if cached:
+        _LAST_RESULT.update(cached)
         return {**cached, "cached": True}
 
-    dns = _dns_google_test()
-    captive = _captive_portal_probe()
-    abuse = _abuseipdb_check(public_ip)
-    tls = _ssl_labs_probe()
+    # Independent probes run concurrently
+    pool = _PROBE_POOL.get()
+    captive_future = pool.submit(_captive_portal_probe)
+    abuse_future = pool.submit(_abuseipdb_check, public_ip)
+    tls_pending = _start_tls_probes()
+    dns = _dns_probe()
+    tls = _collect_tls_probes(tls_pending)
+    captive = captive_future.result()
+    abuse = abuse_future.result()
 
     telemetry = {"ipinfo": ipinfo, "ipapi": ipapi, "dns": dns, "captive": captive, "abuseipdb": abuse, "tls": tls}
     scored = _score(telemetry)
@@ -255,4 +443,5 @@ def auto_wifi_scan() -> Dict[str, Any]:
     }
 
     _cache_set(cache_key, result)
+    _LAST_RESULT.update(result)
     return result
@@ -0,0 +1,61 @@
+"""
+WSGI entrypoint for production servers (see gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Importing this module builds the app and the read-only state every worker
+needs (brand index, URL model, warmed caches, known-bad filter, Safe Browsing
+lists). With `preload_app` this happens once in the gunicorn master, and
+workers share those pages copy-on-write instead of each building their own
+copy.
+
+State the app builds up while serving stays per worker: without MongoDB and
+Redis, the in-memory deception store, deception statistics, campaign clusters
+and search index each only see the events logged through that worker. The
+known-bad filter is shared through the persistent cache file, so every worker
+serves the same generation and versions.
+"""
+
+import gc
+import logging
+
+from dotenv import load_dotenv
+
+# Load .env before the app's modules read their configuration at import time
+load_dotenv()
+
+from app import app, mongo, seed_known_bad_filter  # noqa: E402
+from utils.brand_index import get_brand_index, reload_brand_index  # noqa: E402
+from utils.fraud_enrichment import preload_safe_browsing  # noqa: E402
+from utils.url_model import load_model, reload_model  # noqa: E402
+
+logger = logging.getLogger("wsgi")
+
+
+def _share_with_workers() -> None:
+    # Close pooled Mongo sockets so forked workers open their own; the client reconnects on use
+    if mongo is not None:
+        mongo.close()
+    # Move preloaded objects out of the garbage collector's reach: collections
+    # in workers would otherwise write to their headers and copy the pages
+    gc.freeze()
+
+
+def preload() -> None:
+    get_brand_index()
+    load_model()
+    seed_known_bad_filter()
+    preload_safe_browsing()
+    _share_with_workers()
+
+
+def refresh() -> None:
+    """Rebuild feed-derived state in the master before workers are respawned."""
+    reload_brand_index()
+    reload_model()
+    _share_with_workers()
+    logger.info("Reloaded brand index and URL model")
+
+
+preload()
+application = app
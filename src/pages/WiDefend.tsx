@@ -389,8 +389,8 @@ const WiDefend = () => {
                   </Card>
 
                   <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
-                    <SourceCard title="DNS Safety" value={result.sources?.dns?.ok ? "OK" : `Status ${result.sources?.dns?.status ?? 'unknown'}`} kind="dns" />
-                    <SourceCard title="TLS Certificate" value={result.sources?.tls?.grade || 'unknown'} kind="tls" />
+                    <SourceCard title="DNS Safety" value={result.sources?.dns?.ok ? (result.sources?.dns?.mismatch ? "Differs from DoH" : (result.sources?.dns?.inconclusive ? "OK (DoH check unavailable)" : "OK")) : (result.sources?.dns?.error ? `Lookup failed: ${result.sources.dns.error}` : 'Unknown')} kind="dns" />
+                    <SourceCard title="TLS Certificate" value={result.sources?.tls?.interception_suspected ? 'Interception suspected' : (result.sources?.tls?.hosts?.some((h: any) => h.verified) ? 'Verified' : 'unknown')} kind="tls" />
                     <SourceCard title="Captive Portal" value={result.sources?.captive_portal ? 'Detected' : 'Not detected'} kind="captive" />
                     <SourceCard title="AbuseIPDB" value={typeof result.sources?.abuseipdb?.abuse_confidence === 'number' ? `${result.sources.abuseipdb.abuse_confidence}%` : 'Unknown'} kind="abuse" />
                     <SourceCard title="IP Info" value={result.sources?.ipinfo?.org || 'Unknown'} kind="ip" />